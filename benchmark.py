@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Benchmark get_combinations.py against a synthetic collection, without the production
+Qdrant server.
+
+A collection shaped like gramosynth_v3x_2 (an "audio" named vector plus key, tempo,
+found_stems and stem_<i>_type/filename payloads) is generated in an in-memory Qdrant
+instance, or in the Qdrant server given with --vdb-url. Stem types are drawn from the
+stem_type column of music_stems/seeds/stem_dimension.csv, so the classifier sees the
+same vocabulary as the real data. Vectors are noisy copies of --clusters centroids,
+so similarity searches return hits above the threshold.
+
+Two runs are measured:
+- stages: scroll, search, match_stems, generate_combinations and write one track at
+  a time, each timed separately.
+- end_to_end: the same pipeline as get_combinations.main (scroll, process_tracks
+  and CombinationWriter) in the mode given by --workers/--search-batch-size/--vectorized.
+  Per-track latency is the time between two tracks reaching the writer.
+
+With --compact tracks and hits are fetched and held as track_records; the peak RSS of
+the scroll stage, which holds every track in memory, shows the per-track footprint.
+
+Usage:
+    python benchmark.py --tracks 5000
+    python benchmark.py --tracks 5000 --workers 4 --search-batch-size 32 --output bench.json
+
+Output:
+    JSON report with tracks/sec, p50/p99 per-track latency (ms) and peak RSS (MB)
+    per stage, printed or written to --output.
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+from qdrant_client import models
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import get_combinations as gc
+from clients import configure_vdb_client, get_vdb_client
+from combination_writer import CombinationWriter
+from stem_classifier import DEFAULT_DIMENSION_PATH, StemDimension
+
+DEFAULT_KEYS = "C,C#,D,Eb,E,F,F#,G,Ab,A,Bb,B"
+DEFAULT_TEMPOS = "80,90,100,110,120,128,140"
+GENRES = ["pop", "hip hop", "rnb", "edm", "rock", "jazz", "lofi"]
+MOODS = ["happy", "sad", "chill", "dark", "energetic"]
+ENERGIES = ["low", "medium", "high"]
+
+
+def parse_distribution(spec, cast=str):
+    """Parse "value[:weight],..." into (values, weights), weights defaulting to 1"""
+    values, weights = [], []
+    for item in spec.split(","):
+        value, _, weight = item.strip().partition(":")
+        values.append(cast(value))
+        weights.append(float(weight) if weight else 1.0)
+    return values, weights
+
+
+def load_stem_vocabulary(path=DEFAULT_DIMENSION_PATH):
+    """Return the raw stem types of the stem dimension seed, or the family mapping keys"""
+    if not os.path.exists(path):
+        return sorted(gc.get_stem_family_mapping())
+    with open(path, newline='') as f:
+        return [row['stem_type'] for row in csv.DictReader(f) if row['stem_type']]
+
+
+def generate_points(tracks, dim, keys, tempos, vocabulary, clusters=50, noise=0.3, seed=0):
+    """Yield PointStructs of a synthetic collection"""
+    rng = random.Random(seed)
+    nrng = np.random.default_rng(seed)
+    centroids = nrng.normal(size=(clusters, dim)).astype(np.float32)
+    for point_id in range(tracks):
+        vector = centroids[rng.randrange(clusters)] + noise * nrng.normal(size=dim).astype(np.float32)
+        found_stems = rng.randint(1, 5)
+        payload = {
+            "key": rng.choices(*keys)[0],
+            "tempo": rng.choices(*tempos)[0],
+            "found_stems": found_stems,
+            "folder": f"bench_{point_id % 100}",
+            "audio_filename": f"track_{point_id}.wav",
+            "genre": rng.choice(GENRES),
+            "mood": rng.choice(MOODS),
+            "energy": rng.choice(ENERGIES),
+            "source": "benchmark",
+        }
+        for i in range(1, found_stems + 1):
+            payload[f"stem_{i}_type"] = rng.choice(vocabulary)
+            payload[f"stem_{i}_filename"] = f"track_{point_id}_stem_{i}.wav"
+        yield models.PointStruct(id=point_id, vector={"audio": vector.tolist()}, payload=payload)
+
+
+def build_collection(client, tracks, dim, keys, tempos, vocabulary, clusters=50, noise=0.3, seed=0,
+                     batch_size=512, payload_indexes=True):
+    """Create get_combinations.collection_name and fill it with synthetic tracks"""
+    client.create_collection(
+        gc.collection_name,
+        vectors_config={"audio": models.VectorParams(size=dim, distance=models.Distance.COSINE)}
+    )
+    if payload_indexes:
+        # Same filter fields as get_combinations.build_search_filter
+        client.create_payload_index(gc.collection_name, "key", models.PayloadSchemaType.KEYWORD)
+        client.create_payload_index(gc.collection_name, "tempo", models.PayloadSchemaType.INTEGER)
+        client.create_payload_index(gc.collection_name, "found_stems", models.PayloadSchemaType.INTEGER)
+    points = generate_points(tracks, dim, keys, tempos, vocabulary, clusters, noise, seed)
+    for batch in gc.iter_chunks(points, batch_size):
+        client.upsert(gc.collection_name, batch)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its (waited for) worker processes"""
+    scale = 1024 * 1024 if platform.system() == "Darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / scale, 1)
+
+
+def summarize(latencies, seconds):
+    """Report of one stage, latencies being per-track seconds"""
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        "tracks": len(latencies),
+        "seconds": round(seconds, 4),
+        "tracks_per_sec": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3) if len(latencies) else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def timed_iter(items, latencies):
+    """Iterate over items, appending the time spent producing each one to latencies"""
+    items = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        latencies.append(time.perf_counter() - start)
+        yield item
+
+
+def fetch_tracks(batch_size):
+    # fetch_all_tracks prints every scroll offset
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield from gc.fetch_all_tracks(batch_size)
+
+
+def benchmark_stages(similarity_threshold, search_batch_size, scroll_batch_size, output_dir):
+    """Run the pipeline one stage at a time and return a report per stage
+
+    With search_batch_size the search time of a batch is split evenly across its tracks.
+    """
+    stages = {}
+    latencies = []
+    start = time.perf_counter()
+    tracks = list(timed_iter(fetch_tracks(scroll_batch_size), latencies))
+    stages["scroll"] = summarize(latencies, time.perf_counter() - start)
+
+    latencies = []
+    searched = []
+    start = time.perf_counter()
+    for chunk in gc.iter_chunks(tracks, search_batch_size or 1):
+        chunk_start = time.perf_counter()
+        results = gc._search_chunk(chunk, similarity_threshold, bool(search_batch_size))
+        elapsed = (time.perf_counter() - chunk_start) / len(chunk)
+        latencies.extend([elapsed] * len(chunk))
+        searched.extend(zip(chunk, results))
+    stages["search"] = summarize(latencies, time.perf_counter() - start)
+
+    match = gc.match_stems_vectorized if gc.vectorized_match else gc.match_stems
+    classifier = gc.get_stem_classifier()
+    matched = []
+    latencies = []
+    start = time.perf_counter()
+    for track, similar_tracks in searched:
+        original_stems = gc.get_original_stems(track)
+        if similar_tracks is None or not original_stems:
+            continue
+        track_start = time.perf_counter()
+        stem_pairs = match(original_stems, similar_tracks, classifier, top_k=gc.match_top_k)
+        latencies.append(time.perf_counter() - track_start)
+        matched.append((track, original_stems, stem_pairs))
+    stages["match_stems"] = summarize(latencies, time.perf_counter() - start)
+
+    combinations = []
+    latencies = []
+    start = time.perf_counter()
+    for track, original_stems, stem_pairs in matched:
+        track_start = time.perf_counter()
+        combinations.append(gc.generate_combinations(gc.get_track_path(track), stem_pairs, original_stems,
+                                                     classifier, top_k=gc.output_top_k))
+        latencies.append(time.perf_counter() - track_start)
+    stages["generate_combinations"] = summarize(latencies, time.perf_counter() - start)
+
+    latencies = []
+    start = time.perf_counter()
+    with CombinationWriter(os.path.join(output_dir, "stages.csv")) as writer:
+        for track_combinations in combinations:
+            track_start = time.perf_counter()
+            writer.write(track_combinations)
+            latencies.append(time.perf_counter() - track_start)
+    stages["write"] = summarize(latencies, time.perf_counter() - start)
+    stages["write"]["combinations"] = sum(len(track_combinations) for track_combinations in combinations)
+    return stages
+
+
+def benchmark_end_to_end(similarity_threshold, workers, search_batch_size, scroll_batch_size, output_dir):
+    """Run scroll, process_tracks and the writer together, like get_combinations.main"""
+    latencies = []
+    rows = 0
+    start = time.perf_counter()
+    results = gc.process_tracks(fetch_tracks(scroll_batch_size), similarity_threshold, workers, search_batch_size)
+    with CombinationWriter(os.path.join(output_dir, "end_to_end.csv")) as writer:
+        for _, track_combinations in timed_iter(results, latencies):
+            writer.write(track_combinations)
+            rows += len(track_combinations)
+    report = summarize(latencies, time.perf_counter() - start)
+    report["combinations"] = rows
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark get_combinations.py on a synthetic collection")
+    parser.add_argument("--tracks", type=int, default=2000, help="Tracks in the synthetic collection")
+    parser.add_argument("--dim", type=int, default=128, help="Dimension of the audio vectors")
+    parser.add_argument("--keys", default=DEFAULT_KEYS, help='Key distribution, "value[:weight],..."')
+    parser.add_argument("--tempos", default=DEFAULT_TEMPOS, help='Tempo distribution, "value[:weight],..."')
+    parser.add_argument("--clusters", type=int, default=50, help="Vector centroids (fewer: more similar tracks)")
+    parser.add_argument("--noise", type=float, default=0.3, help="Standard deviation around the centroids")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--vocabulary", default=DEFAULT_DIMENSION_PATH,
+                        help="Stem dimension seed whose stem_type column the stem slots are drawn from")
+    parser.add_argument("--similarity-threshold", type=float, default=0.7)
+    parser.add_argument("--workers", type=int, default=None, help="As in get_combinations.py (end to end only)")
+    parser.add_argument("--search-batch-size", type=int, default=None, help="As in get_combinations.py")
+    parser.add_argument("--scroll-batch-size", type=int, default=100)
+    parser.add_argument("--vectorized", action="store_true", help="Match stems with match_stems_vectorized")
+    parser.add_argument("--compact", action="store_true", help="As in get_combinations.py")
+    parser.add_argument("--search-limit", type=int, default=gc.SEARCH_LIMIT, help="As in get_combinations.py")
+    parser.add_argument("--match-top-k", type=int, default=None, help="As in get_combinations.py")
+    parser.add_argument("--output-top-k", type=int, default=None, help="As in get_combinations.py")
+    parser.add_argument("--stem-dimension", action="store_true",
+                        help="Resolve stem types through music_stems/seeds/stem_dimension.csv")
+    parser.add_argument("--matrix", default=None, help="Compatibility matrix (default: get_combinations.matrix_path)")
+    parser.add_argument("--skip-stages", action="store_true", help="Only run the end to end benchmark")
+    parser.add_argument("--vdb-url", default=":memory:",
+                        help="Qdrant to build the collection in (default: in-memory); must not already "
+                             "contain the collection unless --reuse is given")
+    parser.add_argument("--reuse", action="store_true", help="Benchmark the existing collection as is")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.matrix:
+        gc.matrix_path = args.matrix
+    gc.vectorized_match = args.vectorized
+    gc.compact_records = args.compact
+    gc.search_limit, gc.match_top_k, gc.output_top_k = args.search_limit, args.match_top_k, args.output_top_k
+    if args.stem_dimension:
+        gc.stem_dimension = StemDimension.load()
+
+    configure_vdb_client(url=args.vdb_url)
+    client = get_vdb_client()
+    exists = client.collection_exists(gc.collection_name)
+    if args.reuse and not exists:
+        print(f"Error: Collection '{gc.collection_name}' not found")
+        return 1
+    if not args.reuse:
+        if exists:
+            print(f"Error: Collection '{gc.collection_name}' already exists, pass --reuse to benchmark it")
+            return 1
+        start = time.perf_counter()
+        build_collection(
+            client, args.tracks, args.dim,
+            parse_distribution(args.keys), parse_distribution(args.tempos, int),
+            load_stem_vocabulary(args.vocabulary), args.clusters, args.noise, args.seed,
+            # Payload indexes have no effect in the local Qdrant
+            payload_indexes=args.vdb_url != ":memory:"
+        )
+        print(f"Built {args.tracks} synthetic tracks in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    # Load the matrix before timing anything
+    gc.get_stem_classifier()
+
+    report = {
+        "config": {name: value for name, value in vars(args).items() if name != "output"},
+        "collection_tracks": client.count(gc.collection_name, exact=True).count,
+    }
+    with tempfile.TemporaryDirectory() as output_dir:
+        if not args.skip_stages:
+            report["stages"] = benchmark_stages(args.similarity_threshold, args.search_batch_size,
+                                                args.scroll_batch_size, output_dir)
+        report["end_to_end"] = benchmark_end_to_end(args.similarity_threshold, args.workers,
+                                                    args.search_batch_size, args.scroll_batch_size, output_dir)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"✓ Saved report to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Build the stem dimension seeds of the music_stems dbt project with the Python stem
+classifier used by get_combinations.py.
+
+Every distinct stem type found in the given combinations CSVs (both the replaced and
+the replacing stem types), in the payloads of an offline index export and in the
+family mapping itself is normalized and assigned a family once. Stem types already
+in the dimension keep their ids; pass --rebuild after changing the classifier.
+
+Usage:
+    python build_stem_dimension.py sheets/stem_combinations3.csv
+    python build_stem_dimension.py --offline-index sheets/audio_index
+
+Output:
+    music_stems/seeds/stem_dimension.csv  stem_type, normalized_type, normalized_type_id, family_id
+    music_stems/seeds/stem_families.csv   family_id, stem_family
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from get_combinations import get_stem_family_mapping
+from stem_classifier import (DEFAULT_DIMENSION_PATH, DEFAULT_FAMILIES_PATH, CompatibilityContext,
+                             StemClassifier, StemDimension)
+from track_records import STEM_SLOTS
+
+STEM_TYPE_COLUMNS = ('replaced_stem_type', 'replacing_stem_type')
+
+DEFAULT_COMBINATION_PATHS = ['sheets/stem_combinations3.csv', 'music_stems/seeds/stem_combinations.csv']
+
+
+def stem_types_from_combinations(path):
+    """Yield the stem types of a get_combinations.py output CSV"""
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            for column in STEM_TYPE_COLUMNS:
+                yield row[column]
+
+
+def stem_types_from_offline_index(prefix):
+    """Yield the stem slot types of the payloads exported by offline_index.py"""
+    with open(f"{prefix}.points.jsonl") as f:
+        for line in f:
+            payload = json.loads(line)["payload"] or {}
+            for i in STEM_SLOTS:
+                yield payload.get(f'stem_{i}_type')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the stem_dimension and stem_families seeds")
+    parser.add_argument("combinations", nargs="*",
+                        help="Combinations CSVs to collect stem types from (default: existing "
+                             + ", ".join(DEFAULT_COMBINATION_PATHS) + ")")
+    parser.add_argument("--offline-index", metavar="PREFIX", default=None,
+                        help="Also collect the stem types of an offline_index.py export")
+    parser.add_argument("--output", default=DEFAULT_DIMENSION_PATH)
+    parser.add_argument("--families-output", default=DEFAULT_FAMILIES_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="Reassign all ids instead of extending")
+    args = parser.parse_args(argv)
+
+    family_mapping = get_stem_family_mapping()
+    classifier = StemClassifier(CompatibilityContext.from_family_mapping(family_mapping))
+
+    if os.path.exists(args.output) and not args.rebuild:
+        dimension = StemDimension.load(args.output, args.families_output)
+    else:
+        dimension = StemDimension([])
+
+    paths = args.combinations or [path for path in DEFAULT_COMBINATION_PATHS if os.path.exists(path)]
+    added = dimension.add(classifier, family_mapping)
+    for path in paths:
+        added += dimension.add(classifier, stem_types_from_combinations(path))
+    if args.offline_index:
+        added += dimension.add(classifier, stem_types_from_offline_index(args.offline_index))
+
+    dimension.write(args.output, args.families_output)
+    print(f"✓ Added {added} stem types, {len(dimension.rows)} in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
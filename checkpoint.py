@@ -0,0 +1,69 @@
+"""
+Checkpoints for resumable and incremental get_combinations.py runs.
+
+A checkpoint is a small JSON state file plus an append-only file of processed
+Qdrant point ids, both stored next to the streaming output. The state records the
+scroll offset of the first page that is not fully written and the size of the
+partial output at that point, so a resumed run can truncate any rows written after
+the checkpoint and continue without duplicates.
+"""
+
+import json
+import os
+
+
+class RunCheckpoint:
+    """Progress of a get_combinations run, stored at path (JSON) and path + ".ids"
+
+    The state holds:
+        mode: "full" or "incremental"
+        offset: scroll offset of the first page not yet completed (full runs)
+        output_size: size in bytes of the partial output at the checkpoint
+        complete: whether the run finished
+        similarity_threshold: threshold used by the run
+        top_k: [search limit, match top-k, output top-k] used by the run
+        encode_paths: whether the output has track_id/replacing_stem_id columns
+        path_dictionary_sizes: sizes in bytes of the track and stem path dictionaries
+            at the checkpoint (encode_paths runs)
+        batch_output_size: size in bytes of the partial batch file holding only the rows
+            of an incremental run
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ids_path = f"{path}.ids"
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, **state):
+        # Write to a temporary file first so a crash never leaves a torn checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        for path in (self.path, self.ids_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load_ids(self):
+        """Return the set of point ids recorded as processed"""
+        if not os.path.exists(self.ids_path):
+            return set()
+        with open(self.ids_path) as f:
+            return {json.loads(line) for line in f if line.strip()}
+
+    def add_ids(self, point_ids):
+        # Point ids are JSON encoded to keep integer and UUID ids apart
+        with open(self.ids_path, 'a') as f:
+            f.writelines(f"{json.dumps(point_id)}\n" for point_id in point_ids)
+            f.flush()
+            os.fsync(f.fileno())
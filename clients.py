@@ -1,4 +1,7 @@
 import os
+import random
+import threading
+import time
 ## Qdrant Client
 from qdrant_client import QdrantClient
 from dotenv import load_dotenv
@@ -6,12 +9,144 @@ load_dotenv()
 
 VDB_API_KEY = os.getenv('VDB_API_KEY')
 
-vdb_client = QdrantClient(
-    url="http://209.51.170.42:6333/",
-    api_key=VDB_API_KEY,
-    verify=False,
-    # prefer_grpc=True,
-    # timeout=300
-)
-print(vdb_client.get_collections())
-print(vdb_client.collection_exists("gramosynth_v3x_2"))
+DEFAULT_VDB_URL = "http://209.51.170.42:6333/"
+
+
+def _env_flag(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_number(name, cast, default=None):
+    value = os.getenv(name)
+    return cast(value) if value else default
+
+
+def vdb_config_from_env():
+    """Read the Qdrant client configuration from the environment
+
+    VDB_URL           server URL, or ":memory:" for an in-process instance
+    VDB_API_KEY       API key
+    VDB_PREFER_GRPC   use the gRPC transport (port VDB_GRPC_PORT, default 6334)
+    VDB_TIMEOUT       request timeout in seconds
+    VDB_POOL_SIZE     HTTP connections kept in the shared pool
+    VDB_RETRIES       attempts per request for transient errors (see with_retries)
+    VDB_RETRY_BACKOFF base delay in seconds, doubled after every failed attempt
+    """
+    return {
+        "url": os.getenv("VDB_URL", DEFAULT_VDB_URL),
+        "api_key": VDB_API_KEY,
+        "prefer_grpc": _env_flag("VDB_PREFER_GRPC"),
+        "grpc_port": _env_number("VDB_GRPC_PORT", int, 6334),
+        "timeout": _env_number("VDB_TIMEOUT", int),
+        "pool_size": _env_number("VDB_POOL_SIZE", int, 16),
+        "retries": _env_number("VDB_RETRIES", int, 3),
+        "retry_backoff": _env_number("VDB_RETRY_BACKOFF", float, 0.5),
+    }
+
+
+_config = vdb_config_from_env()
+_vdb_client = None
+_lock = threading.Lock()
+
+
+def configure_vdb_client(**overrides):
+    """Override configuration values (see vdb_config_from_env) before the client is built
+
+    Values that are None are ignored, so CLI options can be passed through as is.
+    Reconfiguring drops the current client; the next get_vdb_client() builds a new one.
+    """
+    global _vdb_client
+    with _lock:
+        _config.update({key: value for key, value in overrides.items() if value is not None})
+        _vdb_client = None
+
+
+def set_vdb_client(client):
+    """Use an already constructed client, e.g. a populated QdrantClient(":memory:")"""
+    global _vdb_client
+    with _lock:
+        _vdb_client = client
+
+
+def create_vdb_client(config):
+    if config["url"] == ":memory:":
+        return QdrantClient(":memory:")
+
+    kwargs = {}
+    if not config["prefer_grpc"]:
+        import httpx
+        # One pool shared by every thread using the client
+        kwargs["limits"] = httpx.Limits(
+            max_connections=config["pool_size"],
+            max_keepalive_connections=config["pool_size"]
+        )
+    return QdrantClient(
+        url=config["url"],
+        api_key=config["api_key"],
+        verify=False,
+        prefer_grpc=config["prefer_grpc"],
+        grpc_port=config["grpc_port"],
+        timeout=config["timeout"],
+        **kwargs
+    )
+
+
+def get_vdb_client():
+    """Return the process-wide Qdrant client, built on first use"""
+    global _vdb_client
+    if _vdb_client is None:
+        with _lock:
+            if _vdb_client is None:
+                _vdb_client = create_vdb_client(_config)
+    return _vdb_client
+
+
+def _is_transient(error):
+    from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code == 429 or error.status_code >= 500
+    if isinstance(error, (ResponseHandlingException, ConnectionError, TimeoutError)):
+        return True
+    try:
+        import httpx
+        if isinstance(error, httpx.TransportError):
+            return True
+    except ImportError:
+        pass
+    try:
+        import grpc
+        if isinstance(error, grpc.RpcError):
+            return error.code() in (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED,
+                                    grpc.StatusCode.RESOURCE_EXHAUSTED)
+    except ImportError:
+        pass
+    return False
+
+
+def with_retries(method, *args, **kwargs):
+    """Call a client method, retrying transient errors with exponential backoff and jitter"""
+    retries = max(_config["retries"], 1)
+    for attempt in range(retries):
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries - 1 or not _is_transient(e):
+                raise
+            time.sleep(_config["retry_backoff"] * 2 ** attempt * (1 + random.random()))
+
+
+def __getattr__(name):
+    # Keep `from clients import vdb_client` working, without connecting at import time
+    if name == "vdb_client":
+        return get_vdb_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == "__main__":
+    client = get_vdb_client()
+    print(client.get_collections())
+    print(client.collection_exists("gramosynth_v3x_2"))
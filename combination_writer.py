@@ -0,0 +1,130 @@
+"""
+Streaming, append-only writer for the rows produced by get_combinations.py.
+
+Rows are buffered and appended to a partial CSV file in chunks, optionally mirrored
+into Parquet row groups, so memory stays flat however many tracks are processed.
+Closing the writer renames the partial file to its final name. RowWriter writes
+rows of any columns (extract_metadata.py uses it for track metadata),
+CombinationWriter defaults to the combination columns.
+"""
+
+import csv
+import os
+
+COMBINATION_COLUMNS = [
+    'track_path',
+    'replaced_stem_type',
+    'replacing_stem_type',
+    'replacing_stem_path',
+    'similarity_score',
+]
+
+# Columns of get_combinations.py --encode-paths rows, with the paths replaced by the
+# ids of path_dictionary.PathDictionary
+ENCODED_COMBINATION_COLUMNS = [
+    'track_id',
+    'replaced_stem_type',
+    'replacing_stem_type',
+    'replacing_stem_id',
+    'similarity_score',
+]
+
+
+class RowWriter:
+    """Append rows with the given columns to path in chunks of chunk_size rows
+
+    Rows are written to partial_path (default: path + ".partial") while the run is in
+    progress and renamed to path by close(). When parquet_path is given every chunk is
+    also written as a Parquet row group (requires pyarrow). With resume_size the
+    existing partial file is truncated to that many bytes and appended to instead.
+    parquet_types maps columns to pyarrow type names (default: string).
+    """
+
+    def __init__(self, path, columns, chunk_size=1000, partial_path=None, parquet_path=None,
+                 resume_size=None, parquet_types=None):
+        self.path = path
+        self.columns = columns
+        self.parquet_types = parquet_types or {}
+        self.chunk_size = chunk_size
+        self.partial_path = partial_path or f"{path}.partial"
+        self.parquet_path = parquet_path
+        self.rows_written = 0
+        self._buffer = []
+
+        if resume_size is None:
+            self._file = open(self.partial_path, 'w', newline='')
+            self._csv = csv.writer(self._file, lineterminator='\n')
+            self._csv.writerow(columns)
+            self._file.flush()
+        else:
+            if parquet_path:
+                raise ValueError("Parquet output cannot be resumed")
+            self._file = open(self.partial_path, 'r+', newline='')
+            self._file.truncate(resume_size)
+            self._file.seek(resume_size)
+            self._csv = csv.writer(self._file, lineterminator='\n')
+
+        self._parquet = None
+        if parquet_path:
+            self._open_parquet(parquet_path)
+
+    def _open_parquet(self, parquet_path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow: pip install pyarrow")
+
+        self._schema = pa.schema([
+            (column, getattr(pa, self.parquet_types.get(column, 'string'))()) for column in self.columns
+        ])
+        self._parquet = pq.ParquetWriter(f"{parquet_path}.partial", self._schema)
+        self._pa = pa
+
+    def write(self, rows):
+        """Buffer rows (dicts keyed by column) and flush every chunk_size rows"""
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self._csv.writerows([row.get(column) for column in self.columns] for row in self._buffer)
+        self._file.flush()
+        if self._parquet is not None:
+            table = self._pa.Table.from_pylist(self._buffer, schema=self._schema)
+            self._parquet.write_table(table)
+        self.rows_written += len(self._buffer)
+        self._buffer = []
+
+    def tell(self):
+        """Return the size of the partial CSV file, including all flushed rows"""
+        return self._file.tell()
+
+    def close(self, complete=True):
+        """Flush pending rows and, if complete, move the partial files to their final names"""
+        self.flush()
+        self._file.close()
+        if self._parquet is not None:
+            self._parquet.close()
+        if complete:
+            os.replace(self.partial_path, self.path)
+            if self._parquet is not None:
+                os.replace(f"{self.parquet_path}.partial", self.parquet_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Leave the partial files in place when the run failed
+        self.close(complete=exc_type is None)
+
+
+class CombinationWriter(RowWriter):
+    """RowWriter of get_combinations.py rows, COMBINATION_COLUMNS unless columns are given"""
+
+    def __init__(self, path, columns=COMBINATION_COLUMNS, parquet_types=None, **kwargs):
+        if parquet_types is None:
+            parquet_types = {'similarity_score': 'float64'}
+        super().__init__(path, columns, parquet_types=parquet_types, **kwargs)
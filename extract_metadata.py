@@ -5,50 +5,71 @@ Helper script to extract track metadata from Qdrant to populate track_metadata.c
 This script reads from the same Qdrant collection used by get_combinations.py
 and extracts genre, mood, energy, key, tempo metadata for each track.
 
+The collection is split into one segment per payload "key" value (plus one for the
+points without a known key), and the segments are scrolled concurrently, fetching
+only the payload fields in METADATA_FIELDS. Rows are written in chunks as they
+arrive and duplicate track paths are dropped with a set of the paths written so far,
+so the whole collection is never held in memory.
+
 Usage:
     python extract_metadata.py
+    python extract_metadata.py --workers 8 --parquet
 
 Output:
     music_stems/seeds/track_metadata.csv
+    music_stems/seeds/track_metadata.parquet (with --parquet)
 """
 
+import argparse
 import os
+import queue
 import sys
-import pandas as pd
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+from qdrant_client import models
 
 # Add parent directory to path to import clients
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from clients import vdb_client
+from clients import get_vdb_client, with_retries
+from combination_writer import RowWriter
 
 collection_name = "gramosynth_v3x_2"
 
-def fetch_all_tracks(batch_size=100):
-    """Fetch all tracks from Qdrant collection"""
+# Payload fields read by extract_metadata, everything else stays on the server
+METADATA_FIELDS = ['folder', 'audio_filename', 'genre', 'mood', 'energy', 'key', 'tempo', 'source']
+
+METADATA_COLUMNS = ['track_path', 'genre', 'mood', 'energy', 'key', 'tempo', 'audio_filename', 'folder', 'source']
+
+def collection_available():
     try:
-        collections = vdb_client.get_collections()
+        collections = with_retries(get_vdb_client().get_collections)
         collection_names = [c.name for c in collections.collections]
         if collection_name not in collection_names:
             print(f"Error: Collection '{collection_name}' not found. Available collections: {collection_names}")
-            return
+            return False
     except Exception as e:
         print(f"Error connecting to Qdrant server: {e}")
-        return
+        return False
+    return True
 
+def fetch_all_tracks(batch_size=100, scroll_filter=None):
+    """Fetch all tracks (or those matching scroll_filter) from Qdrant collection"""
     offset = None
     while True:
-        print(f"Fetching batch at offset: {offset}")
         try:
-            results, next_offset = vdb_client.scroll(
+            results, next_offset = with_retries(
+                get_vdb_client().scroll,
                 collection_name=collection_name,
+                scroll_filter=scroll_filter,
                 limit=batch_size,
                 offset=offset,
-                with_payload=True,
+                with_payload=METADATA_FIELDS,
                 with_vectors=False  # We don't need vectors for metadata extraction
             )
         except Exception as e:
             print(f"Error fetching tracks: {e}")
-            break
+            raise
 
         if not results:
             break
@@ -63,61 +84,178 @@ def fetch_all_tracks(batch_size=100):
         if offset is None:
             break
 
-def extract_metadata():
-    """Extract metadata from all tracks and save to CSV"""
-    metadata_list = []
+def key_segments():
+    """Return scroll filters that together cover the collection, one per payload key
 
-    print("Fetching tracks from Qdrant...")
-    for track in tqdm(fetch_all_tracks()):
-        payload = track['payload']
-
-        # Extract metadata
-        folder = payload.get('folder', '')
-        audio_filename = payload.get('audio_filename', '')
-        track_path = f"s3://rtsy-gramosynth/{folder}/{audio_filename}" if folder and audio_filename else ''
-
-        if not track_path:
-            continue
-
-        metadata = {
-            'track_path': track_path,
-            'genre': payload.get('genre', ''),
-            'mood': payload.get('mood', ''),
-            'energy': payload.get('energy', ''),
-            'key': payload.get('key', ''),
-            'tempo': payload.get('tempo', ''),
-            'audio_filename': audio_filename,
-            'folder': folder,
-            'source': payload.get('source', 'gramosynth')
-        }
-
-        metadata_list.append(metadata)
-
-    # Create DataFrame
-    df = pd.DataFrame(metadata_list)
+    The last filter matches every point whose key is not one of the faceted values
+    (including points without a key). Falls back to a single unfiltered segment when
+    the server cannot facet on "key" (it needs a keyword payload index).
+    """
+    try:
+        facets = with_retries(
+            get_vdb_client().facet,
+            collection_name=collection_name,
+            key="key",
+            limit=10000,
+            exact=True
+        )
+    except Exception as e:
+        print(f"Cannot split the collection by key ({e}), scrolling it as one segment")
+        return [None]
 
-    # Remove duplicates (keep first occurrence)
-    df = df.drop_duplicates(subset=['track_path'], keep='first')
+    keys = [hit.value for hit in facets.hits]
+    segments = [
+        models.Filter(must=[models.FieldCondition(key="key", match=models.MatchValue(value=key))])
+        for key in keys
+    ]
+    segments.append(models.Filter(must_not=[models.FieldCondition(key="key", match=models.MatchAny(any=keys))]))
+    return segments
+
+def fetch_tracks_parallel(segments, workers=4, batch_size=100, queue_size=1000):
+    """Scroll the segments concurrently and yield their tracks as they arrive
+
+    At most queue_size tracks are buffered, so slow writing throttles the scrolls.
+    """
+    tracks = queue.Queue(maxsize=queue_size)
+    done = object()
+    stop = threading.Event()
+
+    def scroll_segment(scroll_filter):
+        try:
+            for track in fetch_all_tracks(batch_size, scroll_filter):
+                if stop.is_set():
+                    return
+                tracks.put(track)
+        finally:
+            tracks.put(done)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(scroll_segment, segment) for segment in segments]
+        try:
+            remaining = len(futures)
+            while remaining:
+                track = tracks.get()
+                if track is done:
+                    remaining -= 1
+                    continue
+                yield track
+        finally:
+            stop.set()
+            # Unblock producers waiting on a full queue
+            while any(not future.done() for future in futures):
+                try:
+                    tracks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        for future in futures:
+            future.result()
 
-    # Sort by track_path for consistency
-    df = df.sort_values('track_path')
+def track_metadata(payload):
+    """Return the track_metadata row of a payload, or None if it has no track path"""
+    folder = payload.get('folder', '')
+    audio_filename = payload.get('audio_filename', '')
+    track_path = f"s3://rtsy-gramosynth/{folder}/{audio_filename}" if folder and audio_filename else ''
 
-    # Save to CSV
+    if not track_path:
+        return None
+
+    return {
+        'track_path': track_path,
+        'genre': payload.get('genre', ''),
+        'mood': payload.get('mood', ''),
+        'energy': payload.get('energy', ''),
+        'key': payload.get('key', ''),
+        'tempo': parse_tempo(payload.get('tempo')),
+        'audio_filename': audio_filename,
+        'folder': folder,
+        'source': payload.get('source', 'gramosynth')
+    }
+
+def parse_tempo(tempo):
+    """Return a payload tempo (number or numeric string) as a float, or None"""
+    if isinstance(tempo, bool):
+        return None
+    try:
+        return float(tempo)
+    except (TypeError, ValueError):
+        return None
+
+class MetadataSummary:
+    """Summary statistics updated row by row"""
+
+    def __init__(self):
+        self.tracks = 0
+        self.genres = set()
+        self.moods = set()
+        self.keys = set()
+        self.min_tempo = None
+        self.max_tempo = None
+        self.sample = []
+
+    def add(self, metadata):
+        self.tracks += 1
+        self.genres.add(metadata['genre'])
+        self.moods.add(metadata['mood'])
+        self.keys.add(metadata['key'])
+        tempo = metadata['tempo']
+        if tempo is not None:
+            self.min_tempo = tempo if self.min_tempo is None else min(self.min_tempo, tempo)
+            self.max_tempo = tempo if self.max_tempo is None else max(self.max_tempo, tempo)
+        if len(self.sample) < 5:
+            self.sample.append(metadata)
+
+def extract_metadata(workers=4, batch_size=100, parquet=False):
+    """Extract metadata from all tracks and save to CSV"""
     output_path = 'music_stems/seeds/track_metadata.csv'
-    df.to_csv(output_path, index=False)
 
-    print(f"\n✓ Extracted metadata for {len(df)} tracks")
+    if not collection_available():
+        return
+
+    print("Fetching tracks from Qdrant...")
+    segments = key_segments() if workers > 1 else [None]
+    print(f"Scrolling {len(segments)} segments with {workers} workers")
+
+    summary = MetadataSummary()
+    # Remove duplicates (keep first occurrence)
+    seen_paths = set()
+    with RowWriter(
+        output_path,
+        METADATA_COLUMNS,
+        parquet_path='music_stems/seeds/track_metadata.parquet' if parquet else None,
+        parquet_types={'tempo': 'float64'}
+    ) as writer:
+        for track in tqdm(fetch_tracks_parallel(segments, workers, batch_size)):
+            metadata = track_metadata(track['payload'] or {})
+            if metadata is None or metadata['track_path'] in seen_paths:
+                continue
+            seen_paths.add(metadata['track_path'])
+            writer.write([metadata])
+            summary.add(metadata)
+
+    print(f"\n✓ Extracted metadata for {summary.tracks} tracks")
     print(f"✓ Saved to {output_path}")
     print(f"\nSample data:")
-    print(df.head())
+    for metadata in summary.sample:
+        print(f"  {metadata['track_path']}: {metadata['genre']}, {metadata['mood']}, "
+              f"{metadata['key']}, {metadata['tempo']} BPM")
 
     # Print summary statistics
     print(f"\nSummary:")
-    print(f"  Total tracks: {len(df)}")
-    print(f"  Unique genres: {df['genre'].nunique()}")
-    print(f"  Unique moods: {df['mood'].nunique()}")
-    print(f"  Unique keys: {df['key'].nunique()}")
-    print(f"  Tempo range: {df['tempo'].min()} - {df['tempo'].max()} BPM")
+    print(f"  Total tracks: {summary.tracks}")
+    print(f"  Unique genres: {len(summary.genres)}")
+    print(f"  Unique moods: {len(summary.moods)}")
+    print(f"  Unique keys: {len(summary.keys)}")
+    print(f"  Tempo range: {summary.min_tempo} - {summary.max_tempo} BPM")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract track metadata from Qdrant")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Segments scrolled concurrently (1: a single serial scroll)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Points per scroll request")
+    parser.add_argument("--parquet", action="store_true",
+                        help="Also write music_stems/seeds/track_metadata.parquet (requires pyarrow)")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    extract_metadata()
+    args = parse_args()
+    extract_metadata(workers=args.workers, batch_size=args.batch_size, parquet=args.parquet)
@@ -1,4 +1,12 @@
+import argparse
+import heapq
+import json
 import os
+import queue
+import threading
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dotenv import load_dotenv
 import pandas as pd
 from tqdm import tqdm
@@ -8,11 +16,34 @@ import sys
 load_dotenv()
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from clients import vdb_client
+from clients import configure_vdb_client, get_vdb_client, with_retries
+from checkpoint import RunCheckpoint
+from combination_writer import COMBINATION_COLUMNS, ENCODED_COMBINATION_COLUMNS, CombinationWriter
+from metrics import enable_metrics, get_metrics
+from neighbor_cache import NeighborCache
+from offline_index import OfflineIndex
+from path_dictionary import CombinationEncoder
+from stem_classifier import (STEM_NAME_REPLACEMENTS, STEM_QUALIFIERS_PATTERN, CompatibilityContext, StemClassifier,
+                             StemDimension)
+from track_records import STEM_SLOTS, TRACK_PAYLOAD_FIELDS, HitRecord, MatchedStem, TrackRecord
 
 collection_name = "gramosynth_v3x_2"
 
+# Fetch only the "audio" vector and the payload fields the pipeline reads, and hold
+# tracks and hits as track_records (--compact)
+compact_records = False
+
+def payload_selector():
+    """with_payload argument of the track fetches and searches"""
+    return TRACK_PAYLOAD_FIELDS if compact_records else True
+
+def query_vector(audio_vector):
+    # Compact tracks hold float32 arrays, the search requests need lists
+    return audio_vector.tolist() if isinstance(audio_vector, np.ndarray) else audio_vector
+
 def process_results(results):
+    if compact_records:
+        return [HitRecord(i, hit.id, hit.score, hit.payload) for i, hit in enumerate(results)]
     return [
         {
             "description": f"{i} - {hit.payload.get('genre', 'Unknown')} - {hit.payload.get('mood', 'Unknown')} - {hit.payload.get('energy', 'Unknown')}",
@@ -24,38 +55,91 @@ def process_results(results):
         for i, hit in enumerate(results)
     ]
 
-def find_similar_tracks(audio_vector, key, tempo, similarity_threshold=0.7):
-    search_result = vdb_client.search(
-        collection_name=collection_name,
-        query_vector=("audio", audio_vector),
-        query_filter=models.Filter(
-            must=[
-                models.FieldCondition(
-                    key="key",
-                    match=models.MatchValue(value=key)
-                ),
-                models.FieldCondition(
-                    key="tempo",
-                    match=models.MatchValue(value=tempo)
-                ),
-                models.FieldCondition(
-                    key="found_stems",
-                    range=models.Range(
-                        gte=2  # Greater than or equal to 3
-                    )
+# Number of hits returned per query; matches the default of QdrantClient.search
+SEARCH_LIMIT = 10
+# Hits requested per query in this run (--search-limit)
+search_limit = SEARCH_LIMIT
+
+def build_search_filter(key, tempo):
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+                key="key",
+                match=models.MatchValue(value=key)
+            ),
+            models.FieldCondition(
+                key="tempo",
+                match=models.MatchValue(value=tempo)
+            ),
+            models.FieldCondition(
+                key="found_stems",
+                range=models.Range(
+                    gte=2  # Greater than or equal to 3
                 )
-            ]
-        ),
-        score_threshold=similarity_threshold
+            )
+        ]
     )
 
-    # Filter out the exact match (100% similarity)
-    filtered_results = [
+def filter_exact_matches(search_result):
+    """Filter out the exact match (100% similarity)"""
+    return [
         result for result in search_result
         if not np.isclose(result.score, 1.0, atol=1e-8)
     ]
 
-    return process_results(filtered_results)
+def search_similar_tracks(audio_vector, key, tempo, similarity_threshold=0.7):
+    """Return the raw Qdrant hits of a similarity search, exact matches included"""
+    with get_metrics().timer("search_seconds"):
+        return with_retries(
+            get_vdb_client().search,
+            collection_name=collection_name,
+            query_vector=("audio", query_vector(audio_vector)),
+            query_filter=build_search_filter(key, tempo),
+            limit=search_limit,
+            with_payload=payload_selector(),
+            score_threshold=similarity_threshold
+        )
+
+def find_similar_tracks(audio_vector, key, tempo, similarity_threshold=0.7):
+    search_result = search_similar_tracks(audio_vector, key, tempo, similarity_threshold)
+
+    return process_results(filter_exact_matches(search_result))
+
+def search_similar_tracks_batch(queries, similarity_threshold=0.7):
+    """Return the raw hits of a list of (audio_vector, key, tempo) queries, searched in one round trip"""
+    requests = [
+        models.SearchRequest(
+            vector=models.NamedVector(name="audio", vector=query_vector(audio_vector)),
+            filter=build_search_filter(key, tempo),
+            limit=search_limit,
+            with_payload=payload_selector(),
+            score_threshold=similarity_threshold
+        )
+        for audio_vector, key, tempo in queries
+    ]
+    metrics = get_metrics()
+    with metrics.timer("search_batch_seconds"):
+        batch_results = with_retries(
+            get_vdb_client().search_batch,
+            collection_name=collection_name,
+            requests=requests
+        )
+    metrics.observe("search_batch_size", len(requests))
+    return batch_results
+
+def find_similar_tracks_batch(queries, similarity_threshold=0.7):
+    """Search similar tracks for a list of (audio_vector, key, tempo) queries in one round trip"""
+    batch_results = search_similar_tracks_batch(queries, similarity_threshold)
+    return [process_results(filter_exact_matches(search_result)) for search_result in batch_results]
+
+def count_search_candidates(key, tempo):
+    """Number of points a search with the (key, tempo) filter can return"""
+    return with_retries(
+        get_vdb_client().count,
+        collection_name=collection_name,
+        count_filter=build_search_filter(key, tempo),
+        exact=True
+    ).count
 
 def normalize_stem_name(stem_name):
     """Normalize stem name to handle variations in naming"""
@@ -68,52 +152,10 @@ def normalize_stem_name(stem_name):
     normalized = stem_name.lower().strip()
     
     # Remove common prefixes/suffixes that don't affect instrument identity
-    normalized = re.sub(r'\b(full|dry|wet|clean|distorted|heavy|light|soft|hard)\b', '', normalized)
-    
-    # Normalize common variations
-    replacements = {
-        # Piano variations
-        r'\b(acoustic\s*piano|grand\s*piano|upright\s*piano)\b': 'piano',
-        r'\bpno\b': 'piano',
-        r'\bgrand\b': 'piano',
-        
-        # Electric piano variations
-        r'\b(electric\s*piano|e\.?piano|e\.?p\.?)\b': 'ep',
-        r'\b(fender\s*)?rhodes\b': 'rhodes',
-        r'\b(wurlitzer|wurly)\b': 'wurli',
-        
-        # Bass variations
-        r'\b(acoustic\s*bass|upright\s*bass|double\s*bass|standup\s*bass)\b': 'upright bass',
-        r'\b(electric\s*bass|bass\s*guitar|e\.?bass)\b': 'electric bass',
-        r'\b(synthesizer\s*bass|synth\s*bass|sub\s*bass)\b': 'synth bass',
-        r'\b(808\s*bass|808\s*sub)\b': '808',
-        
-        # Guitar variations  
-        r'\b(acoustic\s*guitar|nylon\s*guitar|classical\s*guitar)\b': 'nylon',
-        r'\b(steel\s*string|steel\s*guitar|acoustic\s*steel)\b': 'steel',
-        r'\b(electric\s*guitar|e\.?guitar)\b': 'electric clean',
-        r'\b(jazz\s*guitar|clean\s*guitar)\b': 'jazz',
-        r'\b(muted\s*guitar|palm\s*muted)\b': 'muted',
-        
-        # Drums variations
-        r'\b(drum\s*kit|full\s*kit|acoustic\s*drums|live\s*drums)\b': 'full kit',
-        r'\b(808\s*drums|tr\-?808|drum\s*machine)\b': '808 drums',
-        r'\b(percussion\s*loops?|perc\s*loops?)\b': 'perc loops',
-        r'\b(percussion|percussive)\b': 'perc',
-        
-        # Synth variations
-        r'\b(pluck\s*lead|plucked\s*lead)\b': 'pluck lead',
-        r'\b(saw\s*lead|sawtooth\s*lead)\b': 'saw lead',
-        r'\b(arp\s*lead|arpeggio\s*lead|arpeggiated\s*lead)\b': 'arp-lead',
-        r'\b(synthesizer|synth)\b': 'synth',
-        
-        # Organ variations
-        r'\b(hammond\s*organ|b3\s*organ)\b': 'organ',
-        r'\b(clavinet|clav)\b': 'clav',
-    }
+    normalized = re.sub(STEM_QUALIFIERS_PATTERN, '', normalized)
     
     # Apply replacements
-    for pattern, replacement in replacements.items():
+    for pattern, replacement in STEM_NAME_REPLACEMENTS.items():
         normalized = re.sub(pattern, replacement, normalized)
     
     # Remove extra whitespace and punctuation
@@ -122,9 +164,10 @@ def normalize_stem_name(stem_name):
     
     return normalized
 
+matrix_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "sheets", "matrix.csv")
+
 def load_compatibility_matrix():
     """Load compatibility matrix from sheets/matrix.csv"""
-    matrix_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "sheets", "matrix.csv")
     df = pd.read_csv(matrix_path, index_col=0)
     return df
 
@@ -274,9 +317,66 @@ def are_stems_compatible(stem1, stem2, family_mapping, compatibility_matrix):
     
     return False, "none"
 
-def match_stems(original_stems, similar_tracks):
-    family_mapping = get_stem_family_mapping()
-    compatibility_matrix = load_compatibility_matrix()
+# Process-wide compatibility context and classifier, loaded on first use
+_compatibility_context = None
+_stem_classifier = None
+# Reload matrix.csv when its modification time changes
+check_matrix_mtime = False
+# Use match_stems_vectorized instead of match_stems
+vectorized_match = False
+# StemDimension the classifier resolves known stem types from, see build_stem_dimension.py
+stem_dimension = None
+# NeighborCache answering repeated similarity searches, see neighbor_cache.py
+neighbor_cache = None
+# Matches kept per original stem by match_stems (--match-top-k, None: all)
+match_top_k = None
+# Combinations kept per track and replaced stem type (--output-top-k, None: all)
+output_top_k = None
+# Ascending similarity thresholds of a sweep run (--sweep, None: single threshold)
+sweep_thresholds = None
+
+def get_compatibility_context():
+    global _compatibility_context, _stem_classifier
+    if _compatibility_context is None or (check_matrix_mtime and _compatibility_context.is_stale()):
+        _compatibility_context = CompatibilityContext.load(get_stem_family_mapping(), matrix_path)
+        _stem_classifier = None
+    return _compatibility_context
+
+def get_stem_classifier():
+    """Return the process-wide StemClassifier, built on first use"""
+    global _stem_classifier
+    context = get_compatibility_context()
+    if _stem_classifier is None:
+        _stem_classifier = StemClassifier(context, dimension=stem_dimension)
+    return _stem_classifier
+
+def init_worker(context, reload_matrix=False, vectorized=False, dimension=None, metrics_enabled=False,
+                match_k=None, output_k=None, sweep=None):
+    """Install a CompatibilityContext loaded by the parent process in a worker process"""
+    global _compatibility_context, _stem_classifier, check_matrix_mtime, vectorized_match, stem_dimension
+    global match_top_k, output_top_k, sweep_thresholds
+    _compatibility_context = context
+    _stem_classifier = None
+    check_matrix_mtime = reload_matrix
+    vectorized_match = vectorized
+    stem_dimension = dimension
+    match_top_k = match_k
+    output_top_k = output_k
+    sweep_thresholds = sweep
+    if metrics_enabled:
+        enable_metrics()
+
+# Sort priority of each match type, used by both match_stems implementations
+MATCH_TYPE_PRIORITY = {"exact": 0, "variation": 1, "same_family": 2, "matrix_compatible": 3}
+MATCH_TYPES_BY_PRIORITY = sorted(MATCH_TYPE_PRIORITY, key=MATCH_TYPE_PRIORITY.get)
+
+def match_stems(original_stems, similar_tracks, classifier=None, top_k=None):
+    """Return the compatible stems of the similar tracks for each original stem
+
+    Matches are ordered by match type priority, then similarity; with top_k only the
+    first top_k matches of each original stem are kept.
+    """
+    classifier = classifier or get_stem_classifier()
     stem_pairs = []
     
     for original_stem in original_stems:
@@ -285,57 +385,151 @@ def match_stems(original_stems, similar_tracks):
         matched_stems = []
         
         for track in similar_tracks:
-            for i in range(1, 8):
+            for i in STEM_SLOTS:
                 stem_type = track['payload'].get(f'stem_{i}_type', '')
                 stem_filename = track['payload'].get(f'stem_{i}_filename')
                 
                 if stem_type and stem_filename:
                     # Use matrix-based compatibility checking
-                    is_compatible, match_type = are_stems_compatible(original_stem_type, stem_type, family_mapping, compatibility_matrix)
+                    is_compatible, match_type = classifier.compatible(original_stem_type, stem_type)
                     
                     if is_compatible:
-                        matched_stems.append({
-                            "track_description": track['description'],
-                            "stem_type": stem_type,
-                            "stem_filename": stem_filename,
-                            "folder": track['payload'].get('folder'),
-                            "source": track['payload'].get('source'),
-                            "similarity_score": track['score'],
-                            "match_type": match_type,
-                            "original_normalized": normalize_stem_name(original_stem_type),
-                            "matched_normalized": normalize_stem_name(stem_type)
-                        })
+                        matched_stems.append(MatchedStem(
+                            track_description=track['description'],
+                            stem_type=stem_type,
+                            stem_filename=stem_filename,
+                            folder=track['payload'].get('folder'),
+                            source=track['payload'].get('source'),
+                            similarity_score=track['score'],
+                            match_type=match_type,
+                            original_normalized=classifier.normalize(original_stem_type),
+                            matched_normalized=classifier.normalize(stem_type)
+                        ))
 
         if matched_stems:
             # Sort by match type priority and then by similarity score
-            match_type_priority = {"exact": 0, "variation": 1, "same_family": 2, "matrix_compatible": 3}
-            matched_stems.sort(key=lambda x: (match_type_priority.get(x['match_type'], 4), -x['similarity_score']))
+            matched_stems.sort(key=lambda x: (MATCH_TYPE_PRIORITY.get(x['match_type'], 4), -x['similarity_score']))
             
             stem_pairs.append({
                 "original_stem": original_stem,
-                "matched_stems": matched_stems
+                "matched_stems": matched_stems[:top_k]
             })
     return stem_pairs
 
-def generate_combinations(track_path, stem_pairs, all_original_stems):
-    family_mapping = get_stem_family_mapping()
+def match_stems_vectorized(original_stems, similar_tracks, classifier=None, top_k=None):
+    """Same result as match_stems, computed with NumPy over all stem slots at once
+
+    Every stem slot of the similar tracks is encoded as a (normalized type id, family id)
+    pair, the match priority of all originals x slots is computed from the family x family
+    compatibility array and each original's matches are ordered with np.lexsort.
+    """
+    classifier = classifier or get_stem_classifier()
+    compatible_families = classifier.context.compatible
+
+    slots = []
+    for track in similar_tracks:
+        for i in STEM_SLOTS:
+            stem_type = track['payload'].get(f'stem_{i}_type', '')
+            stem_filename = track['payload'].get(f'stem_{i}_filename')
+            if stem_type and stem_filename:
+                slots.append((track, stem_type, stem_filename))
+    if not slots or not original_stems:
+        return []
+
+    original_types = [
+        original_stem.split(" (")[0] if "(" in original_stem else original_stem
+        for original_stem in original_stems
+    ]
+    original_codes = np.array([classifier.encode(stem_type) for stem_type in original_types]).reshape(-1, 2)
+    slot_codes = np.array([classifier.encode(stem_type) for _, stem_type, _ in slots]).reshape(-1, 2)
+    scores = np.array([track['score'] for track, _, _ in slots], dtype=float)
+
+    original_type_ids, original_family_ids = original_codes[:, 0], original_codes[:, 1]
+    slot_type_ids, slot_family_ids = slot_codes[:, 0], slot_codes[:, 1]
+
+    exact = original_type_ids[:, None] == slot_type_ids[None, :]
+
+    # Substring variations only depend on the distinct normalized types involved
+    unique_original, original_index = np.unique(original_type_ids, return_inverse=True)
+    unique_slot, slot_index = np.unique(slot_type_ids, return_inverse=True)
+    types = classifier.types
+    variation_by_type = np.array([
+        [types[a] in types[b] or types[b] in types[a] for b in unique_slot]
+        for a in unique_original
+    ], dtype=bool).reshape(len(unique_original), len(unique_slot))
+    variation = variation_by_type[original_index.reshape(-1)[:, None], slot_index.reshape(-1)[None, :]]
+
+    known_families = (original_family_ids[:, None] >= 0) & (slot_family_ids[None, :] >= 0)
+    matrix_compatible = known_families & compatible_families[
+        np.maximum(original_family_ids, 0)[:, None], np.maximum(slot_family_ids, 0)[None, :]
+    ]
+    same_family = known_families & (original_family_ids[:, None] == slot_family_ids[None, :])
+
+    priority = np.select(
+        [exact, variation, matrix_compatible, same_family],
+        [MATCH_TYPE_PRIORITY[match_type] for match_type in ("exact", "variation", "matrix_compatible", "same_family")],
+        default=-1
+    )
+
+    stem_pairs = []
+    for original_stem, original_stem_type, stem_priority in zip(original_stems, original_types, priority):
+        matched = np.flatnonzero(stem_priority >= 0)
+        if not len(matched):
+            continue
+        # lexsort is stable, so ties keep the slot order like list.sort does
+        matched = matched[np.lexsort((-scores[matched], stem_priority[matched]))][:top_k]
+        original_normalized = classifier.normalize(original_stem_type)
+        stem_pairs.append({
+            "original_stem": original_stem,
+            "matched_stems": [
+                MatchedStem(
+                    track_description=slots[slot][0]['description'],
+                    stem_type=slots[slot][1],
+                    stem_filename=slots[slot][2],
+                    folder=slots[slot][0]['payload'].get('folder'),
+                    source=slots[slot][0]['payload'].get('source'),
+                    similarity_score=slots[slot][0]['score'],
+                    match_type=MATCH_TYPES_BY_PRIORITY[stem_priority[slot]],
+                    original_normalized=original_normalized,
+                    matched_normalized=classifier.normalize(slots[slot][1])
+                )
+                for slot in matched
+            ]
+        })
+    return stem_pairs
+
+def composite_quality_score(similarity_score, same_family):
+    """Same score as composite_quality_score in the int_quality_scored dbt model"""
+    return round(similarity_score * 70 + (30 if same_family else 0), 2)
+
+def generate_combinations(track_path, stem_pairs, all_original_stems, classifier=None, top_k=None):
+    """Return the combination rows of a track
+
+    With top_k only the top_k combinations of each replaced stem type are kept, ranked
+    like int_best_combinations_per_track (composite quality score, then similarity),
+    using a bounded heap per stem type. Kept rows stay in generation order.
+    """
+    classifier = classifier or get_stem_classifier()
     all_combinations = []
+    # replaced stem type -> min-heap of ((composite score, similarity, -position), position, row)
+    top_combinations = {}
+    position = 0
     
     # Get families of all original stems (excluding the one being replaced)
     original_families = []
     for stem in all_original_stems:
         stem_type = stem.split(" (")[0] if "(" in stem else stem
-        family = get_stem_family(stem_type, family_mapping)
+        family = classifier.family(stem_type)
         if family:
             original_families.append(family)
     
     for pair in stem_pairs:
         original_stem = pair['original_stem']
         original_stem_type = original_stem.split(" (")[0]
-        original_family = get_stem_family(original_stem_type, family_mapping)
+        original_family = classifier.family(original_stem_type)
         
         for matched_stem in pair['matched_stems']:
-            replacing_family = get_stem_family(matched_stem['stem_type'], family_mapping)
+            replacing_family = classifier.family(matched_stem['stem_type'])
             
             # Check if replacing with this stem would create a duplicate family
             remaining_families = [f for f in original_families if f != original_family]
@@ -345,95 +539,846 @@ def generate_combinations(track_path, stem_pairs, all_original_stems):
                 continue
                 
             folder = matched_stem['folder']
-            all_combinations.append({
+            combination = {
                 'track_path': track_path,
                 'replaced_stem_type': original_stem_type,
                 'replacing_stem_type': matched_stem['stem_type'],
                 'replacing_stem_path': f"s3://rtsy-gramosynth/{folder}/{matched_stem['stem_filename']}",
                 'similarity_score': matched_stem['similarity_score']
-            })
-    return all_combinations
+            }
+            if top_k is None:
+                all_combinations.append(combination)
+                continue
 
-def process_track(track, similarity_threshold):
+            same_family = original_family is not None and replacing_family == original_family
+            position += 1
+            rank = (composite_quality_score(matched_stem['similarity_score'], same_family),
+                    matched_stem['similarity_score'], -position)
+            heap = top_combinations.setdefault(original_stem_type, [])
+            if len(heap) < top_k:
+                heapq.heappush(heap, (rank, position, combination))
+            elif rank > heap[0][0]:
+                heapq.heapreplace(heap, (rank, position, combination))
+
+    if top_k is None:
+        return all_combinations
+    kept = sorted(item[1:] for heap in top_combinations.values() for item in heap)
+    return [combination for _, combination in kept]
+
+def get_search_query(track):
+    """Return the (audio_vector, key, tempo) search query of a track, or None if incomplete"""
     audio_vector = track["vector"]["audio"]
     key = track['payload'].get('key')
     tempo = track['payload'].get('tempo')
 
-    if not all([audio_vector, key, tempo]):
-        return []
-
-    similar_tracks = find_similar_tracks(audio_vector, key, tempo, similarity_threshold)
+    if audio_vector is None or not len(audio_vector) or not key or not tempo:
+        return None
+    return audio_vector, key, tempo
 
+def get_original_stems(track):
     original_stems = []
     for i in range(1, 6):
         stem_type = track['payload'].get(f'stem_{i}_type')
         stem_filename = track['payload'].get(f'stem_{i}_filename')
         if stem_type and stem_filename:
             original_stems.append(f"{stem_type} ({stem_filename})")
+    return original_stems
+
+def get_track_path(track):
+    folder =  track['payload'].get('folder', '')
+    return f"s3://rtsy-gramosynth/{folder}/{track['payload'].get('audio_filename', '')}"
 
+def combine_track(track, similar_tracks):
+    """Match and combine the stems of a track against its similar tracks
+
+    In a sweep run, return {threshold: combinations} instead (see combine_track_sweep).
+    """
+    if sweep_thresholds:
+        return combine_track_sweep(track, similar_tracks, sweep_thresholds)
+    original_stems = get_original_stems(track)
     if not original_stems:
         return []
 
-    stem_pairs = match_stems(original_stems, similar_tracks)
-    folder =  track['payload'].get('folder', '')
-    track_path = f"s3://rtsy-gramosynth/{folder}/{track['payload'].get('audio_filename', '')}"
-    return generate_combinations(track_path, stem_pairs, original_stems)
+    metrics = get_metrics()
+    metrics.observe("candidates_per_track", len(similar_tracks))
+    with metrics.timer("match_stems_seconds"):
+        if vectorized_match:
+            stem_pairs = match_stems_vectorized(original_stems, similar_tracks, top_k=match_top_k)
+        else:
+            stem_pairs = match_stems(original_stems, similar_tracks, top_k=match_top_k)
+    with metrics.timer("generate_combinations_seconds"):
+        return generate_combinations(get_track_path(track), stem_pairs, original_stems, top_k=output_top_k)
+
+def combine_track_sweep(track, similar_tracks, thresholds):
+    """Return {threshold: combinations} of a track searched at the lowest threshold
+
+    Hits are ordered by score, so the hits of a search at a higher threshold are the
+    hits scoring at least that threshold (Qdrant keeps scores >= score_threshold).
+    Metrics are labelled with the threshold.
+    """
+    original_stems = get_original_stems(track)
+    if not original_stems:
+        return {}
+
+    metrics = get_metrics()
+    track_path = get_track_path(track)
+    combinations = {}
+    for threshold in thresholds:
+        hits = [hit for hit in similar_tracks if hit['score'] >= threshold]
+        metrics.observe("candidates_per_track", len(hits), similarity_threshold=threshold)
+        with metrics.timer("match_stems_seconds", similarity_threshold=threshold):
+            if vectorized_match:
+                stem_pairs = match_stems_vectorized(original_stems, hits, top_k=match_top_k)
+            else:
+                stem_pairs = match_stems(original_stems, hits, top_k=match_top_k)
+        with metrics.timer("generate_combinations_seconds", similarity_threshold=threshold):
+            combinations[threshold] = generate_combinations(track_path, stem_pairs, original_stems,
+                                                            top_k=output_top_k)
+    return combinations
+
+def record_cache_stats(metrics, classifier):
+    """Add the classifier cache hits/misses since the last call to the metrics counters"""
+    reported = getattr(classifier, "_reported_cache_info", {})
+    for cache, info in classifier.cache_info().items():
+        hits, misses = reported.get(cache, (0, 0))
+        metrics.inc("classifier_cache_hits_total", info.hits - hits, cache=cache)
+        metrics.inc("classifier_cache_misses_total", info.misses - misses, cache=cache)
+        reported[cache] = (info.hits, info.misses)
+    classifier._reported_cache_info = reported
+
+def combine_track_measured(track, similar_tracks):
+    """combine_track for worker processes, also returning the samples it recorded"""
+    combinations = combine_track(track, similar_tracks)
+    metrics = get_metrics()
+    record_cache_stats(metrics, get_stem_classifier())
+    return combinations, metrics.drain()
+
+def search_track(track, similarity_threshold):
+    """Return the similar tracks of a track, or None when it cannot yield combinations"""
+    query = get_search_query(track)
+    # Tracks without stems yield no combinations, so skip their search
+    if query is None or not get_original_stems(track):
+        return None
+    if neighbor_cache is None:
+        return find_similar_tracks(*query, similarity_threshold)
+
+    search_result = get_cached_neighbors(track, query, similarity_threshold)
+    if search_result is None:
+        search_result = search_similar_tracks(*query, similarity_threshold)
+        neighbor_cache.put(track['id'], *query, similarity_threshold, search_result, search_limit)
+    return process_results(filter_exact_matches(search_result))
+
+def get_cached_neighbors(track, query, similarity_threshold):
+    """Return the raw hits of a track from the neighbor cache, or None"""
+    search_result = neighbor_cache.get(track['id'], *query, similarity_threshold, search_limit)
+    get_metrics().inc("neighbor_cache_hits_total" if search_result is not None else "neighbor_cache_misses_total")
+    return search_result
+
+def search_tracks_batch(chunk, similarity_threshold):
+    """Like search_track for every track in chunk, using a single Qdrant batch search
+
+    Queries sharing a key/tempo filter are grouped next to each other in the batch.
+    """
+    groups = {}
+    for index, track in enumerate(chunk):
+        query = get_search_query(track)
+        if query is None or not get_original_stems(track):
+            continue
+        _, key, tempo = query
+        groups.setdefault((key, tempo), []).append((index, query))
+
+    searches = [item for group in groups.values() for item in group]
+    similar = [None] * len(chunk)
+    if neighbor_cache is not None:
+        missing = []
+        for index, query in searches:
+            search_result = get_cached_neighbors(chunk[index], query, similarity_threshold)
+            if search_result is None:
+                missing.append((index, query))
+            else:
+                similar[index] = process_results(filter_exact_matches(search_result))
+        if missing:
+            batch_results = search_similar_tracks_batch([query for _, query in missing], similarity_threshold)
+            for (index, query), search_result in zip(missing, batch_results):
+                neighbor_cache.put(chunk[index]['id'], *query, similarity_threshold, search_result, search_limit)
+                similar[index] = process_results(filter_exact_matches(search_result))
+        return similar
+
+    if searches:
+        batch_results = find_similar_tracks_batch([query for _, query in searches], similarity_threshold)
+        for (index, _), result in zip(searches, batch_results):
+            similar[index] = result
+    return similar
+
+def combine_searched_track(track, similar_tracks):
+    if similar_tracks is None:
+        return []
+    return combine_track(track, similar_tracks)
+
+def process_track(track, similarity_threshold):
+    return combine_searched_track(track, search_track(track, similarity_threshold))
+
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def process_tracks_serial(tracks, similarity_threshold):
+    """Yield (track, combinations) for each track, one search at a time"""
+    for track in tracks:
+        yield track, process_track(track, similarity_threshold)
+
+def process_tracks_batched(tracks, similarity_threshold, batch_size):
+    """Yield (track, combinations) for each track, searching batch_size tracks per Qdrant request"""
+    for chunk in iter_chunks(tracks, batch_size):
+        for track, similar_tracks in zip(chunk, search_tracks_batch(chunk, similarity_threshold)):
+            yield track, combine_searched_track(track, similar_tracks)
+
+def process_tracks_offline(index, similarity_threshold, skip_ids=None):
+    """Yield (track, combinations) for each track of an OfflineIndex, without Qdrant traffic
+
+    Tracks whose id is in skip_ids (already processed by a previous run) are left out;
+    they are still candidates of the other tracks' searches.
+    """
+    skip_ids = skip_ids or set()
+    for track, hits in tqdm(index.iter_similar(similarity_threshold, limit=search_limit), total=len(index)):
+        if track['id'] in skip_ids:
+            continue
+        similar_tracks = None if hits is None else process_results(filter_exact_matches(hits))
+        yield track, combine_searched_track(track, similar_tracks)
+
+def _search_chunk(chunk, similarity_threshold, batched):
+    if batched:
+        return search_tracks_batch(chunk, similarity_threshold)
+    return [search_track(track, similarity_threshold) for track in chunk]
+
+def prefetch(items, queue_size):
+    """Iterate over items produced by a background thread, buffering at most queue_size of them"""
+    buffer = queue.Queue(maxsize=queue_size)
+    done = object()
+    errors = []
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put(item)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            buffer.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is done:
+            break
+        yield item
+    if errors:
+        raise errors[0]
+
+def process_tracks_concurrent(tracks, similarity_threshold, workers, search_batch_size=None, prefetch_size=200):
+    """Yield (track, combinations) for each track, overlapping Qdrant I/O with stem matching
 
-def fetch_all_tracks(batch_size=100):
+    The next scroll pages are prefetched by a background thread, searches run on a
+    thread pool and match_stems/generate_combinations run on a process pool. Both
+    stages keep at most 2 * workers jobs in flight and results are yielded in the
+    original track order.
+    """
+    batched = bool(search_batch_size)
+    max_pending = 2 * workers
+    searches = deque()
+    combines = deque()
+    metrics = get_metrics()
+    # Worker processes send their samples back with every track when metrics are on
+    combine = combine_track_measured if metrics.enabled else combine_track
+
+    with ThreadPoolExecutor(max_workers=workers) as search_pool, \
+            ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_worker,
+                initargs=(get_compatibility_context(), check_matrix_mtime, vectorized_match, stem_dimension,
+                          metrics.enabled, match_top_k, output_top_k, sweep_thresholds)
+            ) as combine_pool:
+
+        def finish_search():
+            chunk, future = searches.popleft()
+            for track, similar_tracks in zip(chunk, future.result()):
+                if similar_tracks is None:
+                    combines.append((track, None))
+                else:
+                    combines.append((track, combine_pool.submit(combine, track, similar_tracks)))
+
+        def finish_combines(limit):
+            while len(combines) > limit:
+                track, future = combines.popleft()
+                if future is None:
+                    yield track, []
+                elif metrics.enabled:
+                    track_combinations, samples = future.result()
+                    metrics.merge(samples)
+                    yield track, track_combinations
+                else:
+                    yield track, future.result()
+
+        for chunk in iter_chunks(prefetch(tracks, prefetch_size), search_batch_size or 1):
+            searches.append((chunk, search_pool.submit(_search_chunk, chunk, similarity_threshold, batched)))
+            if len(searches) >= max_pending:
+                finish_search()
+                yield from finish_combines(max_pending)
+
+        while searches:
+            finish_search()
+            yield from finish_combines(max_pending)
+        yield from finish_combines(0)
+
+def process_tracks(tracks, similarity_threshold, workers=None, search_batch_size=None):
+    """Yield (track, combinations) for each track with the processing mode main() was asked for"""
+    if workers:
+        return process_tracks_concurrent(tracks, similarity_threshold, workers, search_batch_size)
+    if search_batch_size:
+        return process_tracks_batched(tracks, similarity_threshold, search_batch_size)
+    return process_tracks_serial(tracks, similarity_threshold)
+
+def collection_available():
     try:
         # Check if collection exists
-        collections = vdb_client.get_collections()
+        collections = with_retries(get_vdb_client().get_collections)
         collection_names = [c.name for c in collections.collections]
         if collection_name not in collection_names:
             print(f"Error: Collection '{collection_name}' not found. Available collections: {collection_names}")
-            return
+            return False
     except Exception as e:
         print(f"Error connecting to Qdrant server: {e}")
+        return False
+    return True
+
+def make_track(point, page_offset):
+    """Return the track record of a fetched point"""
+    if compact_records:
+        return TrackRecord.from_point(point, page_offset)
+    return {
+        "id": point.id,
+        "payload": point.payload,
+        "vector": point.vector,
+        "page_offset": page_offset
+    }
+
+def fetch_all_tracks(batch_size=100, offset=None):
+    """Yield every track, starting at the given scroll offset
+
+    Each track carries the "page_offset" of the scroll page it came from.
+    """
+    if not collection_available():
         return
-    
-    offset = None
+
     while True:
         print("Offset", offset)
         try:
-            results, next_offset = vdb_client.scroll(
-                collection_name=collection_name,
-                limit=batch_size,
-                offset=offset,
-                with_payload=True,
-                with_vectors=True
-            )
+            with get_metrics().timer("scroll_seconds"):
+                results, next_offset = with_retries(
+                    get_vdb_client().scroll,
+                    collection_name=collection_name,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=payload_selector(),
+                    with_vectors=["audio"] if compact_records else True
+                )
         except Exception as e:
             print(f"Error fetching tracks: {e}")
             break
             
         if not results:
             break
+        get_metrics().inc("tracks_fetched_total", len(results))
         for track in results:
-            yield {
-                "id": track.id,
-                "payload": track.payload,
-                "vector": track.vector
-            }
+            yield make_track(track, offset)
         offset = next_offset
         # break
         if offset is None:
             break
 
-def main(similarity_threshold=0.7):
-    all_combinations = []
+def fetch_new_tracks(processed_ids, batch_size=100):
+    """Yield the tracks whose point id is not in processed_ids
+
+    The collection is scrolled without payloads or vectors to find the new ids,
+    which are then retrieved in pages of batch_size. Each track carries the
+    "page_offset" of its retrieve page (the first point id of the page).
+    """
+    if not collection_available():
+        return
+
+    new_ids = []
+    offset = None
+    while True:
+        try:
+            with get_metrics().timer("scroll_seconds"):
+                results, offset = with_retries(
+                    get_vdb_client().scroll,
+                    collection_name=collection_name,
+                    limit=1000,
+                    offset=offset,
+                    with_payload=False,
+                    with_vectors=False
+                )
+        except Exception as e:
+            print(f"Error fetching track ids: {e}")
+            return
+        new_ids.extend(point.id for point in results if point.id not in processed_ids)
+        if not results or offset is None:
+            break
+    print(f"Found {len(new_ids)} new tracks")
+
+    for page_ids in iter_chunks(new_ids, batch_size):
+        try:
+            with get_metrics().timer("retrieve_seconds"):
+                results = with_retries(
+                    get_vdb_client().retrieve,
+                    collection_name=collection_name,
+                    ids=page_ids,
+                    with_payload=payload_selector(),
+                    with_vectors=["audio"] if compact_records else True
+                )
+        except Exception as e:
+            print(f"Error fetching tracks: {e}")
+            break
+        get_metrics().inc("tracks_fetched_total", len(results))
+        for track in results:
+            yield make_track(track, page_ids[0])
 
-    for track in tqdm(fetch_all_tracks()):
-        track_combinations = process_track(track, similarity_threshold)
-        all_combinations.extend(track_combinations)
-        interim_df = pd.DataFrame(all_combinations)
-        interim_df.to_csv(f'sheets/results_.csv', index=False)
+def main(similarity_threshold=0.7, search_batch_size=None, workers=None, reload_matrix=False, parquet=False,
+         resume=False, incremental=False, vectorized=False, offline_index=None, use_stem_dimension=False,
+         metrics_path=None, prometheus_path=None, neighbor_cache_path=None, neighbor_cache_size=1_000_000,
+         limit=SEARCH_LIMIT, match_k=None, output_k=None, compact=False, sweep=None, encode_paths=False):
+    """Write the combinations of every track to sheets/stem_combinations3.csv
+
+    With encode_paths the rows carry track_id/replacing_stem_id instead of the paths,
+    assigned by the sheets/track_paths.csv and sheets/stem_paths.csv dictionaries (see
+    path_dictionary.py). With sweep (a list of similarity thresholds) the collection is searched once at the
+    lowest threshold and the combinations of each threshold are written by write_sweep
+    instead, without a checkpoint.
+    """
+    global check_matrix_mtime, vectorized_match, stem_dimension, _stem_classifier, neighbor_cache
+    global search_limit, match_top_k, output_top_k, compact_records, sweep_thresholds
+    check_matrix_mtime = reload_matrix
+    vectorized_match = vectorized
+    compact_records = compact
+    if use_stem_dimension:
+        stem_dimension = StemDimension.load()
+        _stem_classifier = None
+    if sweep and (resume or incremental):
+        print("Error: Sweep runs cannot be resumed or incremental")
+        return
+    if parquet and (resume or incremental):
+        # Checked before the previous output is moved to the partial path
+        print("Error: Parquet output cannot be resumed or extended, run without --parquet")
+        return
+    # Sweep runs report their cost per threshold from the metrics
+    metrics = enable_metrics() if metrics_path or prometheus_path or sweep else get_metrics()
+
+    output_path = 'sheets/stem_combinations3.csv'
+    # Incremental runs also write their new rows here, to be loaded with load_to_postgres.py --append
+    batch_path = 'sheets/stem_combinations3.batch.csv'
+    # Rows are appended to sheets/results_.csv as tracks complete and the file is
+    # renamed to stem_combinations3.csv once every track has been processed
+    partial_path = 'sheets/results_.csv'
+    checkpoint = RunCheckpoint('sheets/stem_combinations3.checkpoint.json')
+
+    mode, offset, resume_size, dictionary_sizes, batch_resume_size = "full", None, None, None, None
+    if resume:
+        if not checkpoint.exists():
+            print("Error: No checkpoint to resume from")
+            return
+        state = checkpoint.load()
+        if state['complete']:
+            print("Last run already completed, nothing to resume")
+            return
+        mode, offset, resume_size = state['mode'], state['offset'], state['output_size']
+        similarity_threshold = state['similarity_threshold']
+        limit, match_k, output_k = state.get('top_k', [SEARCH_LIMIT, None, None])
+        encode_paths = state.get('encode_paths', False)
+        dictionary_sizes = state.get('path_dictionary_sizes')
+        batch_resume_size = state.get('batch_output_size')
+        print(f"Resuming {mode} run from offset {offset}")
+    elif incremental:
+        if not checkpoint.exists() or not checkpoint.load()['complete']:
+            print("Error: Incremental runs need a completed previous run")
+            return
+        # Append the new rows to the previous output, in its format
+        mode = "incremental"
+        encode_paths = checkpoint.load().get('encode_paths', False)
+        os.replace(output_path, partial_path)
+        resume_size = os.path.getsize(partial_path)
+    elif sweep:
+        sweep_thresholds = sorted(set(sweep))
+        similarity_threshold = sweep_thresholds[0]
+    else:
+        checkpoint.reset()
+        # A batch file left by an earlier incremental run is not part of this output
+        if os.path.exists(batch_path):
+            os.remove(batch_path)
+    search_limit, match_top_k, output_top_k = limit, match_k, output_k
+
+    if offline_index:
+        skip_ids = checkpoint.load_ids() if mode == "incremental" else None
+        results = process_tracks_offline(OfflineIndex(offline_index), similarity_threshold, skip_ids)
+    else:
+        if neighbor_cache_path:
+            neighbor_cache = NeighborCache(neighbor_cache_path, collection_name, count_search_candidates,
+                                           max_entries=neighbor_cache_size)
+        if mode == "incremental":
+            tracks = tqdm(fetch_new_tracks(checkpoint.load_ids()))
+        else:
+            tracks = tqdm(fetch_all_tracks(offset=offset))
+
+        results = process_tracks(tracks, similarity_threshold, workers, search_batch_size)
+
+    if sweep_thresholds:
+        write_sweep(results, sweep_thresholds, 'sheets/sweep', parquet)
+        close_neighbor_cache()
+        summary = sweep_summary(metrics, sweep_thresholds)
+        with open('sheets/sweep/summary.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+            f.write("\n")
+        print_sweep_summary(summary)
+        print("Sweep results saved to sheets/sweep")
+        sweep_thresholds = None
+        record_cache_stats(metrics, get_stem_classifier())
+        if prometheus_path:
+            metrics.write_prometheus(prometheus_path)
+        if metrics_path:
+            metrics.write_json(metrics_path, mode="sweep", **derived_metrics(metrics))
+        return
 
-    # Create a new DataFrame with the results
-    results_df = pd.DataFrame(all_combinations)
+    encoder = CombinationEncoder.open(resume_sizes=dictionary_sizes) if encode_paths else None
+    columns = ENCODED_COMBINATION_COLUMNS if encode_paths else COMBINATION_COLUMNS
+    with ExitStack() as stack:
+        writer = stack.enter_context(CombinationWriter(
+            output_path,
+            columns=columns,
+            partial_path=partial_path,
+            parquet_path='sheets/stem_combinations3.parquet' if parquet else None,
+            resume_size=resume_size,
+            parquet_types={'track_id': 'int64', 'replacing_stem_id': 'int64', 'similarity_score': 'float64'}
+        ))
+        batch_writer = None
+        if mode == "incremental":
+            batch_writer = stack.enter_context(CombinationWriter(batch_path, columns=columns,
+                                                                 resume_size=batch_resume_size))
 
-    # Save the results to an Excel file
-    results_df.to_csv('sheets/stem_combinations3.csv', index=False)
+        def save_checkpoint(offset, page_ids):
+            # Rows and the ids they use must be on disk before the page is recorded as completed
+            with metrics.timer("checkpoint_seconds"):
+                writer.flush()
+                if batch_writer is not None:
+                    batch_writer.flush()
+                if encoder is not None:
+                    encoder.flush()
+                checkpoint.add_ids(page_ids)
+                checkpoint.save(
+                    mode=mode,
+                    offset=offset,
+                    output_size=writer.tell(),
+                    complete=False,
+                    similarity_threshold=similarity_threshold,
+                    top_k=[search_limit, match_top_k, output_top_k],
+                    encode_paths=encode_paths,
+                    path_dictionary_sizes=encoder.tell() if encoder is not None else None,
+                    batch_output_size=batch_writer.tell() if batch_writer is not None else None
+                )
+            if prometheus_path:
+                record_cache_stats(metrics, get_stem_classifier())
+                metrics.write_prometheus(prometheus_path)
+
+        save_checkpoint(offset, [])
+        page_ids = []
+        for track, track_combinations in results:
+            if track['page_offset'] != offset:
+                save_checkpoint(track['page_offset'], page_ids)
+                offset, page_ids = track['page_offset'], []
+            page_ids.append(track['id'])
+            with metrics.timer("write_seconds"):
+                rows = encoder.encode(track_combinations) if encoder is not None else track_combinations
+                writer.write(rows)
+                if batch_writer is not None:
+                    batch_writer.write(rows)
+            metrics.inc("tracks_processed_total", similarity_threshold=similarity_threshold)
+            metrics.inc("combinations_total", len(track_combinations), similarity_threshold=similarity_threshold)
+        save_checkpoint(None, page_ids)
+    if encoder is not None:
+        encoder.close()
+
+    close_neighbor_cache()
+
+    checkpoint.save(
+        mode=mode,
+        offset=None,
+        output_size=os.path.getsize(output_path),
+        complete=True,
+        similarity_threshold=similarity_threshold,
+        top_k=[search_limit, match_top_k, output_top_k],
+        encode_paths=encode_paths
+    )
     print("Results saved to stem_combinations3.csv")
+    if mode == "incremental":
+        print(f"New rows of this run saved to {os.path.basename(batch_path)}")
+
+    if metrics.enabled:
+        record_cache_stats(metrics, get_stem_classifier())
+        if prometheus_path:
+            metrics.write_prometheus(prometheus_path)
+        if metrics_path:
+            metrics.write_json(metrics_path, mode=mode, **derived_metrics(metrics))
+            print(f"Metrics saved to {metrics_path}")
+
+def close_neighbor_cache():
+    global neighbor_cache
+    if neighbor_cache is not None:
+        print(f"Neighbor cache: {neighbor_cache.hits} hits, {neighbor_cache.misses} misses")
+        neighbor_cache.close()
+        neighbor_cache = None
+
+def write_sweep(results, thresholds, output_dir, parquet=False):
+    """Write the {threshold: combinations} results of a sweep run, one CSV per threshold"""
+    os.makedirs(output_dir, exist_ok=True)
+    metrics = get_metrics()
+    with ExitStack() as stack:
+        writers = {
+            threshold: stack.enter_context(CombinationWriter(
+                os.path.join(output_dir, f"stem_combinations3_{threshold}.csv"),
+                parquet_path=os.path.join(output_dir, f"stem_combinations3_{threshold}.parquet") if parquet else None
+            ))
+            for threshold in thresholds
+        }
+        for _, track_combinations in results:
+            # Tracks without stems or search query come back as []
+            track_combinations = track_combinations or {}
+            for threshold, writer in writers.items():
+                rows = track_combinations.get(threshold, [])
+                with metrics.timer("write_seconds", similarity_threshold=threshold):
+                    writer.write(rows)
+                metrics.inc("tracks_processed_total", similarity_threshold=threshold)
+                metrics.inc("combinations_total", len(rows), similarity_threshold=threshold)
+                if rows:
+                    metrics.inc("tracks_with_combinations_total", similarity_threshold=threshold)
+
+def sweep_summary(metrics, thresholds):
+    """Return the combination yield and per-stage seconds of each threshold of a sweep run
+
+    Scroll and search run once at the lowest threshold and are reported as shared.
+    """
+    summary = metrics.summary()
+
+    def named(name, threshold=None):
+        return name if threshold is None else f'{name}{{similarity_threshold="{threshold}"}}'
+
+    def seconds(name, threshold=None):
+        histogram = summary["histograms"].get(named(name, threshold))
+        return round(histogram["sum"], 3) if histogram else 0.0
+
+    shared = {
+        stage: seconds(f"{stage}_seconds")
+        for stage in ("scroll", "retrieve", "search", "search_batch")
+        if named(f"{stage}_seconds") in summary["histograms"]
+    }
+    per_threshold = {}
+    for threshold in thresholds:
+        tracks = summary["counters"].get(named("tracks_processed_total", threshold), 0)
+        combinations = summary["counters"].get(named("combinations_total", threshold), 0)
+        candidates = summary["histograms"].get(named("candidates_per_track", threshold))
+        per_threshold[str(threshold)] = {
+            "tracks": tracks,
+            "tracks_with_combinations": summary["counters"].get(named("tracks_with_combinations_total", threshold), 0),
+            "combinations": combinations,
+            "combinations_per_track": round(combinations / tracks, 4) if tracks else None,
+            "candidates_per_track": candidates["mean"] if candidates else None,
+            "seconds": {
+                stage: seconds(f"{stage}_seconds", threshold)
+                for stage in ("match_stems", "generate_combinations", "write")
+            },
+        }
+    return {
+        "search_threshold": thresholds[0],
+        "search_limit": search_limit,
+        "elapsed_seconds": summary["elapsed_seconds"],
+        "shared_seconds": shared,
+        "thresholds": per_threshold,
+    }
+
+def print_sweep_summary(summary):
+    print(f"Searched once at {summary['search_threshold']} (limit {summary['search_limit']}), "
+          f"shared seconds: {summary['shared_seconds']}")
+    print(f"{'threshold':>10} {'tracks':>8} {'with rows':>10} {'rows':>10} {'rows/track':>10} "
+          f"{'match s':>9} {'generate s':>10} {'write s':>8}")
+    for threshold, row in summary["thresholds"].items():
+        stage = row["seconds"]
+        print(f"{threshold:>10} {row['tracks']:>8} {row['tracks_with_combinations']:>10} {row['combinations']:>10} "
+              f"{row['combinations_per_track'] or 0:>10} {stage['match_stems']:>9} "
+              f"{stage['generate_combinations']:>10} {stage['write']:>8}")
+
+def derived_metrics(metrics):
+    """Return the classifier cache hit rates and the combinations per track of each threshold"""
+    counters = metrics.summary()["counters"]
+
+    def counter(name, **labels):
+        return counters.get(name + "".join(f'{{{label}="{value}"}}' for label, value in labels.items()), 0)
+
+    cache_hit_rate = {}
+    for cache in get_stem_classifier().cache_info():
+        hits = counter("classifier_cache_hits_total", cache=cache)
+        misses = counter("classifier_cache_misses_total", cache=cache)
+        cache_hit_rate[cache] = round(hits / (hits + misses), 4) if hits + misses else None
+    hits = counter("neighbor_cache_hits_total")
+    misses = counter("neighbor_cache_misses_total")
+    if hits + misses:
+        cache_hit_rate["neighbors"] = round(hits / (hits + misses), 4)
+
+    combination_yield = {}
+    for (name, label_key), tracks in metrics.counters.items():
+        if name == "tracks_processed_total" and tracks:
+            threshold = dict(label_key)["similarity_threshold"]
+            combinations = counter("combinations_total", similarity_threshold=threshold)
+            combination_yield[threshold] = {
+                "tracks": tracks,
+                "combinations": combinations,
+                "combinations_per_track": round(combinations / tracks, 4),
+            }
+    return {"cache_hit_rate": cache_hit_rate, "combination_yield": combination_yield}
+
+def parse_thresholds(value):
+    try:
+        return [float(threshold) for threshold in value.split(",") if threshold.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid threshold list: {value}") from None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate stem replacement combinations from Qdrant")
+    parser.add_argument("--similarity-threshold", type=float, default=0.7)
+    parser.add_argument(
+        "--search-batch-size", type=int, default=None,
+        help="Number of tracks sent per Qdrant batch search (default: one search per track)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Run searches and stem matching concurrently with this many workers per stage"
+    )
+    parser.add_argument(
+        "--reload-matrix", action="store_true",
+        help="Pick up edits to sheets/matrix.csv during the run"
+    )
+    parser.add_argument(
+        "--parquet", action="store_true",
+        help="Also write the combinations to sheets/stem_combinations3.parquet"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Continue an interrupted run from its last checkpoint"
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only process tracks added since the last completed run"
+    )
+    parser.add_argument(
+        "--vectorized", action="store_true",
+        help="Match stems with the NumPy implementation (match_stems_vectorized)"
+    )
+    parser.add_argument(
+        "--offline-index", metavar="PREFIX", default=None,
+        help="Search vectors exported with offline_index.py instead of querying Qdrant"
+    )
+    parser.add_argument(
+        "--stem-dimension", action="store_true",
+        help="Resolve stem types through music_stems/seeds/stem_dimension.csv (see build_stem_dimension.py)"
+    )
+    parser.add_argument(
+        "--sweep", type=parse_thresholds, default=None, metavar="T1,T2,...",
+        help="Search once at the lowest of these similarity thresholds and write the combinations of each "
+             "to sheets/sweep/, with a yield and cost summary (replaces --similarity-threshold)"
+    )
+    parser.add_argument(
+        "--search-limit", type=int, default=SEARCH_LIMIT,
+        help="Similar tracks returned per similarity search"
+    )
+    parser.add_argument(
+        "--match-top-k", type=int, default=None,
+        help="Keep the best K matches per original stem (exact and variation matches first, then similarity)"
+    )
+    parser.add_argument(
+        "--output-top-k", type=int, default=None,
+        help="Write the best K combinations per track and replaced stem type, ranked like "
+             "int_best_combinations_per_track (which keeps 3)"
+    )
+    parser.add_argument(
+        "--encode-paths", action="store_true",
+        help="Write track_id/replacing_stem_id instead of the S3 paths, with the paths in sheets/track_paths.csv "
+             "and sheets/stem_paths.csv"
+    )
+    parser.add_argument(
+        "--compact", action="store_true",
+        help="Fetch only the audio vector and the payload fields used here, held as float32 arrays and slot records"
+    )
+    parser.add_argument(
+        "--neighbor-cache", metavar="PATH", default=None,
+        help="Reuse similarity search results stored in this SQLite file (e.g. sheets/neighbor_cache.sqlite)"
+    )
+    parser.add_argument(
+        "--neighbor-cache-size", type=int, default=1_000_000,
+        help="Search results kept in the neighbor cache before the least recently used are evicted"
+    )
+    parser.add_argument(
+        "--metrics", metavar="PATH", default=None,
+        help="Record per-stage timings, candidate counts and cache hit rates and write a JSON summary to PATH"
+    )
+    parser.add_argument(
+        "--metrics-prometheus", metavar="PATH", default=None,
+        help="Record metrics and keep PATH updated as a Prometheus textfile (refreshed every scroll page)"
+    )
+    parser.add_argument("--vdb-url", default=None, help="Qdrant URL (default: $VDB_URL)")
+    parser.add_argument("--prefer-grpc", action="store_true", default=None, help="Talk to Qdrant over gRPC")
+    parser.add_argument("--timeout", type=int, default=None, help="Qdrant request timeout in seconds")
+    args = parser.parse_args(argv)
+    if args.parquet and (args.resume or args.incremental):
+        parser.error("--parquet cannot be used with --resume or --incremental")
+    if args.offline_index:
+        # The offline index is searched in process, one partition at a time
+        for option, value in (("--workers", args.workers), ("--search-batch-size", args.search_batch_size),
+                              ("--neighbor-cache", args.neighbor_cache)):
+            if value:
+                parser.error(f"{option} cannot be used with --offline-index")
+    return args
 
 if __name__ == "__main__":
-    main(similarity_threshold=0.7)
+    args = parse_args()
+    configure_vdb_client(
+        url=args.vdb_url,
+        prefer_grpc=args.prefer_grpc,
+        timeout=args.timeout,
+        # Every search thread shares the client's connection pool
+        pool_size=max(args.workers, 16) if args.workers else None
+    )
+    main(
+        similarity_threshold=args.similarity_threshold,
+        search_batch_size=args.search_batch_size,
+        workers=args.workers,
+        reload_matrix=args.reload_matrix,
+        parquet=args.parquet,
+        resume=args.resume,
+        incremental=args.incremental,
+        vectorized=args.vectorized,
+        offline_index=args.offline_index,
+        use_stem_dimension=args.stem_dimension,
+        metrics_path=args.metrics,
+        prometheus_path=args.metrics_prometheus,
+        neighbor_cache_path=args.neighbor_cache,
+        neighbor_cache_size=args.neighbor_cache_size,
+        limit=args.search_limit,
+        match_k=args.match_top_k,
+        output_k=args.output_top_k,
+        compact=args.compact,
+        sweep=args.sweep,
+        encode_paths=args.encode_paths
+    )
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Load test replacement_service.py against the marts of a local Postgres.
+
+Start the database from docker-compose.yaml (docker-compose up -d db), load the
+combinations and run dbt (see music_stems/README.md), then run this script from the
+repo root. Three things are measured:
+- load: time to load the index from the marts, and of a refresh poll that finds no
+  new dbt run (the steady-state cost of --refresh-interval)
+- in_process: ReplacementIndex lookups (ranked replacements and recommendation of a
+  random track and stem), one at a time
+- http: --concurrency keep-alive connections sending GET /replacements requests for
+  random tracks and stems for --duration seconds, against a replacement_service.py
+  started in a separate process (or the one at --url)
+
+Usage:
+    python load_test_service.py
+    python load_test_service.py --concurrency 64 --duration 30 --output load.json
+    python load_test_service.py --url http://localhost:8080
+
+Output:
+    JSON report with QPS and p50/p99/p99.9/max latency per measurement, printed or
+    written to --output.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from replacement_service import DEFAULT_SCHEMA, ReplacementService
+
+
+def summarize(latencies, seconds, unit="us", errors=0):
+    """Report of one measurement, latencies being per-request seconds"""
+    scale = 1e6 if unit == "us" else 1e3
+    latencies = np.asarray(latencies, dtype=np.float64) * scale
+    report = {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 4),
+        "qps": round(len(latencies) / seconds, 1) if seconds else None,
+    }
+    for name, q in (("p50", 50), ("p99", 99), ("p999", 99.9), ("max", 100)):
+        report[f"{name}_{unit}"] = round(float(np.percentile(latencies, q)), 3) if len(latencies) else None
+    return report
+
+
+def sample_keys(index, count, seed=0):
+    """Random (track_id, replaced stem type) pairs of the index"""
+    keys = [(track_id, stem_type) for track_id, track in index.tracks.items() for stem_type in track.stems]
+    if not keys:
+        raise SystemExit("Error: the marts hold no replacements, run dbt first")
+    rng = random.Random(seed)
+    return [rng.choice(keys) for _ in range(count)]
+
+
+def measure_in_process(index, keys):
+    latencies = []
+    start = time.perf_counter()
+    for track_id, stem_type in keys:
+        request_start = time.perf_counter()
+        index.lookup(track_id, stem_type)
+        index.recommendation(track_id, stem_type)
+        latencies.append(time.perf_counter() - request_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def http_worker(host, port, keys, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        i = 0
+        while time.perf_counter() < deadline:
+            track_id, stem_type = keys[i % len(keys)]
+            i += 1
+            request_start = time.perf_counter()
+            writer.write(f"GET /replacements?track_id={track_id}&stem={quote(stem_type)} HTTP/1.1\r\n"
+                         f"Host: {host}\r\n\r\n".encode())
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - request_start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def measure_http(host, port, keys, concurrency, duration):
+    latencies, errors = [], []
+    # Every connection walks its own slice of the keys
+    slices = [keys[i::concurrency] or keys for i in range(concurrency)]
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(http_worker(host, port, keys_slice, deadline, latencies, errors) for keys_slice in slices))
+    return summarize(latencies, time.perf_counter() - start, unit="ms", errors=len(errors))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_service(schema, timeout=300):
+    """Start replacement_service.py in a separate process, return (process, host, port) once it listens"""
+    port = free_port()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "replacement_service.py")
+    process = subprocess.Popen(
+        [sys.executable, script, "--port", str(port), "--schema", schema, "--refresh-interval", "0"],
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Error: replacement_service.py exited with code {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, "127.0.0.1", port
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f"Error: replacement_service.py did not start within {timeout}s")
+
+
+async def run(args):
+    service = ReplacementService(schema=args.schema, refresh_interval=0)
+    start = time.perf_counter()
+    await service.start()
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    await service.refresh()
+    refresh_seconds = time.perf_counter() - start
+    await service.close()
+
+    report = {
+        "config": {name: value for name, value in vars(args).items() if name != "output"},
+        "load": {
+            "tracks": len(service.index),
+            "load_seconds": round(load_seconds, 4),
+            "noop_refresh_ms": round(refresh_seconds * 1000, 3),
+        },
+    }
+    keys = sample_keys(service.index, args.requests, args.seed)
+    report["in_process"] = measure_in_process(service.index, keys)
+    print(f"In process: {report['in_process']['qps']} lookups/s", file=sys.stderr)
+
+    if args.concurrency:
+        process = None
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            process, host, port = start_service(args.schema)
+        try:
+            report["http"] = await measure_http(host, port, keys, args.concurrency, args.duration)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+        print(f"HTTP: {report['http']['qps']} requests/s", file=sys.stderr)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the replacement lookup service")
+    parser.add_argument("--schema", default=DEFAULT_SCHEMA, help="Schema of the dbt marts")
+    parser.add_argument("--requests", type=int, default=100000, help="In-process lookups (and HTTP keys) to sample")
+    parser.add_argument("--concurrency", type=int, default=16, help="HTTP connections (0 to skip the HTTP test)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of HTTP load")
+    parser.add_argument("--url", default=None, help="Test a running replacement_service.py instead of starting one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+"""
+Bulk load get_combinations.py and extract_metadata.py output into Postgres with COPY.
+
+dbt seed inserts rows in batches, which does not scale to millions of generated
+combinations. This script streams the CSV output straight into the raw tables read
+by the music_stems dbt project (declared as the `raw` source) using COPY FROM STDIN,
+with the column types configured for the seeds in dbt_project.yml.
+
+Usage:
+    python load_to_postgres.py
+    python load_to_postgres.py --combinations sheets/stem_combinations3.csv --append
+
+Connection settings come from POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER,
+POSTGRES_PASSWORD and POSTGRES_DB (defaults match docker-compose.yaml), and the
+target schema from RAW_SCHEMA (default: music_stems_raw, where dbt seed puts the seeds).
+
+Every load into stem_combinations is tagged with a new load_batch_id (the previous
+maximum + 1), which drives the incremental dbt models: only the tracks present in
+batches newer than the last dbt run are recomputed.
+
+After each load the table's indexes (TABLE_INDEXES) are created if missing and the
+table is ANALYZEd; --cluster additionally rewrites stem_combinations in track_id
+order, which keeps per-track lookups and BRIN ranges tight after many appends.
+
+With --partitioned, stem_combinations is created as a table partitioned by list on
+the track's key and sub-partitioned by tempo range (TEMPO_PARTITION_BOUNDS, the same
+bounds as the dbt tempo_partition_bounds var). Combinations carry no key or tempo,
+so they are looked up in track_metadata while loading; load the metadata first.
+--replace-key swaps the rows of a single key partition in one transaction:
+
+    python load_to_postgres.py --partitioned --metadata '' --combinations key_c.csv --replace-key C
+
+stem_combinations holds integer track_id/replacing_stem_id keys instead of the S3
+paths (see path_dictionary.py). Output of get_combinations.py --encode-paths is
+loaded as is; path-based CSVs are encoded while loading, extending the dictionaries.
+Each combinations load also replaces the track_paths and stem_paths tables with the
+dictionaries (--track-paths, --stem-paths) in the same transaction.
+"""
+
+import argparse
+import csv
+import io
+import os
+import re
+import sys
+
+from combination_writer import ENCODED_COMBINATION_COLUMNS
+from path_dictionary import DEFAULT_STEM_PATHS, DEFAULT_TRACK_PATHS, CombinationEncoder
+
+# Column names and types of the raw tables, matching the seed column_types
+TABLE_COLUMNS = {
+    "stem_combinations": [
+        ("track_id", "integer"),
+        ("replaced_stem_type", "text"),
+        ("replacing_stem_type", "text"),
+        ("replacing_stem_id", "integer"),
+        ("similarity_score", "numeric"),
+    ],
+    "track_paths": [
+        ("track_id", "integer"),
+        ("track_path", "text"),
+    ],
+    "stem_paths": [
+        ("stem_id", "integer"),
+        ("stem_path", "text"),
+    ],
+    "track_metadata": [
+        ("track_path", "text"),
+        ("genre", "text"),
+        ("mood", "text"),
+        ("energy", "text"),
+        ("key", "text"),
+        ("tempo", "numeric"),
+        ("audio_filename", "text"),
+        ("folder", "text"),
+        ("source", "text"),
+    ],
+}
+
+# Indexes kept on the raw tables as (column, method): track_id serves the per-track
+# incremental models, track_path the metadata join, and load_batch_id only grows with
+# appended rows, so a small BRIN index covers the "newer batches" filter
+TABLE_INDEXES = {
+    "stem_combinations": [("track_id", "btree"), ("load_batch_id", "brin")],
+    "track_metadata": [("track_path", "btree")],
+    "track_paths": [("track_id", "btree"), ("track_path", "btree")],
+    "stem_paths": [("stem_id", "btree")],
+}
+
+# Path columns of get_combinations.py rows, encoded into the stem_combinations ids
+PATH_COLUMNS = {"track_path", "replacing_stem_path"}
+
+# Tables whose rows hold path dictionary ids, loaded with a CombinationEncoder
+ENCODED_TABLES = {"stem_combinations"}
+
+# Tempo range boundaries (BPM) of the stem_combinations sub-partitions
+TEMPO_PARTITION_BOUNDS = (80, 110, 140)
+
+# Tables whose loads are tagged with a load_batch_id column
+BATCHED_TABLES = {"stem_combinations"}
+
+DEFAULT_SCHEMA = os.getenv("RAW_SCHEMA", "music_stems_raw")
+
+
+def connection_settings():
+    """psycopg2 connection keyword arguments from the POSTGRES_* environment variables"""
+    return {
+        "host": os.getenv("POSTGRES_HOST", "localhost"),
+        "port": int(os.getenv("POSTGRES_PORT", "5432")),
+        "user": os.getenv("POSTGRES_USER", "dbt_user"),
+        "password": os.getenv("POSTGRES_PASSWORD", "dbt_password"),
+        "dbname": os.getenv("POSTGRES_DB", "my_warehouse"),
+    }
+
+
+def connect():
+    import psycopg2
+
+    return psycopg2.connect(**connection_settings())
+
+
+def qualified(schema, table):
+    return f'"{schema}"."{table}"'
+
+
+def ensure_table(cursor, schema, table):
+    columns = ", ".join(f'"{name}" {type_}' for name, type_ in TABLE_COLUMNS[table])
+    cursor.execute(f'create schema if not exists "{schema}"')
+    cursor.execute(f"create table if not exists {qualified(schema, table)} ({columns})")
+    check_columns(cursor, schema, table)
+    if table in BATCHED_TABLES:
+        # Also covers tables created by dbt seed, which has no batch column
+        cursor.execute(f"alter table {qualified(schema, table)} add column if not exists load_batch_id bigint")
+
+
+def check_columns(cursor, schema, table):
+    """Fail on tables created with other columns, e.g. stem_combinations with paths instead of ids"""
+    cursor.execute(
+        "select column_name from information_schema.columns where table_schema = %s and table_name = %s",
+        (schema, table),
+    )
+    existing = {row[0] for row in cursor.fetchall()}
+    missing = [name for name, _ in TABLE_COLUMNS[table] if name not in existing]
+    if missing:
+        raise ValueError(f"{schema}.{table} is missing columns {missing}; drop it to reload it")
+
+
+def find_index(cursor, schema, table, column):
+    """Return the name of an index led by column, e.g. one created by dbt seed, or None"""
+    cursor.execute(
+        "select i.indexrelid::regclass::text from pg_index i join pg_attribute a "
+        "on a.attrelid = i.indrelid and a.attnum = i.indkey[0] "
+        "where i.indrelid = %s::regclass and a.attname = %s",
+        (qualified(schema, table), column),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def ensure_indexes(cursor, schema, table):
+    for column, method in TABLE_INDEXES.get(table, []):
+        if find_index(cursor, schema, table, column):
+            continue
+        cursor.execute(
+            f'create index if not exists "{table}_{column}_idx" '
+            f'on {qualified(schema, table)} using {method} ("{column}")'
+        )
+
+
+def cluster_table(conn, table, schema=DEFAULT_SCHEMA, column="track_id"):
+    """Rewrite schema.table in the order of its column index (takes an exclusive lock)"""
+    # CLUSTER of a partitioned table cannot run inside a transaction block
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            index = find_index(cursor, schema, table, column)
+            if index is None:
+                raise ValueError(f"No index on {schema}.{table}.{column} to cluster on")
+            # regclass text is quoted as needed but may carry the schema, which CLUSTER rejects
+            cursor.execute(f"cluster {qualified(schema, table)} using {index.split('.')[-1]}")
+            cursor.execute(f"analyze {qualified(schema, table)}")
+    finally:
+        conn.autocommit = False
+
+
+def next_load_batch_id(cursor, schema, table):
+    cursor.execute(f"select coalesce(max(load_batch_id), 0) + 1 from {qualified(schema, table)}")
+    return cursor.fetchone()[0]
+
+
+class RowStream(io.TextIOBase):
+    """Read-only text stream rendering an iterable of row value lists as CSV for COPY"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._pending = ""
+        self._line = io.StringIO()
+        self._writer = csv.writer(self._line)
+
+    def readable(self):
+        return True
+
+    def _next_line(self):
+        next_row = next(self._rows)
+        self._line.seek(0)
+        self._line.truncate()
+        self._writer.writerow(next_row)
+        return self._line.getvalue()
+
+    def read(self, size=-1):
+        chunks = [self._pending]
+        length = len(self._pending)
+        try:
+            while size < 0 or length < size:
+                line = self._next_line()
+                chunks.append(line)
+                length += len(line)
+        except StopIteration:
+            pass
+        data = "".join(chunks)
+        if size < 0:
+            self._pending = ""
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+
+def relation_kind(cursor, schema, table):
+    """Return the pg_class relkind of schema.table ('r' table, 'p' partitioned), or None"""
+    cursor.execute(
+        "select c.relkind from pg_class c join pg_namespace n on n.oid = c.relnamespace "
+        "where n.nspname = %s and c.relname = %s",
+        (schema, table),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def partition_name(table, key):
+    return f"{table}_" + re.sub(r"[^a-z0-9]+", "_", key.lower().replace("#", "s"))
+
+
+def ensure_partitioned_table(cursor, schema, table):
+    kind = relation_kind(cursor, schema, table)
+    if kind == "p":
+        check_columns(cursor, schema, table)
+        return
+    if kind is not None:
+        raise ValueError(f"{schema}.{table} exists and is not partitioned; drop it to reload it partitioned")
+
+    columns = TABLE_COLUMNS[table] + [("load_batch_id", "bigint"), ("key", "text"), ("tempo", "numeric")]
+    column_list = ", ".join(f'"{name}" {type_}' for name, type_ in columns)
+    cursor.execute(f'create schema if not exists "{schema}"')
+    cursor.execute(f"create table {qualified(schema, table)} ({column_list}) partition by list (key)")
+    # Rows of tracks without metadata (no key) land in the default partition
+    cursor.execute(f'create table {qualified(schema, f"{table}_default")} partition of {qualified(schema, table)} default')
+
+
+def create_tempo_partitions(cursor, schema, parent):
+    bounds = ["minvalue", *TEMPO_PARTITION_BOUNDS, "maxvalue"]
+    for i, (low, high) in enumerate(zip(bounds, bounds[1:])):
+        cursor.execute(
+            f'create table if not exists {qualified(schema, f"{parent}_t{i}")} '
+            f"partition of {qualified(schema, parent)} for values from ({low}) to ({high})"
+        )
+    cursor.execute(
+        f'create table if not exists {qualified(schema, f"{parent}_tdefault")} '
+        f"partition of {qualified(schema, parent)} default"
+    )
+
+
+def ensure_key_partition(cursor, schema, table, key):
+    name = partition_name(table, key)
+    cursor.execute(
+        f"create table if not exists {qualified(schema, name)} partition of {qualified(schema, table)} "
+        f"for values in (%s) partition by range (tempo)",
+        (key,),
+    )
+    create_tempo_partitions(cursor, schema, name)
+
+
+def swap_key_partition(cursor, schema, table, key, select_sql):
+    """Replace the key partition of schema.table with the rows of select_sql
+
+    The new partition is built next to the old one and swapped in with DETACH/ATTACH
+    inside the caller's transaction, so readers see either the old or the new rows.
+    """
+    name = partition_name(table, key)
+    new_name = f"{name}_new"
+    cursor.execute(f"drop table if exists {qualified(schema, new_name)}")
+    cursor.execute(
+        f"create table {qualified(schema, new_name)} (like {qualified(schema, table)}) partition by range (tempo)"
+    )
+    create_tempo_partitions(cursor, schema, new_name)
+    # A matching check constraint lets ATTACH skip scanning the new partition
+    cursor.execute(
+        f'alter table {qualified(schema, new_name)} add constraint "{new_name}_key" '
+        f"check (key is not null and key = %s)",
+        (key,),
+    )
+    cursor.execute(f"insert into {qualified(schema, new_name)} {select_sql}")
+
+    cursor.execute(
+        "select 1 from pg_inherits i join pg_class c on c.oid = i.inhrelid "
+        "where i.inhparent = %s::regclass and c.relname = %s",
+        (qualified(schema, table), name),
+    )
+    if cursor.fetchone():
+        cursor.execute(f"alter table {qualified(schema, table)} detach partition {qualified(schema, name)}")
+        cursor.execute(f"drop table {qualified(schema, name)}")
+    cursor.execute(
+        f"alter table {qualified(schema, table)} attach partition {qualified(schema, new_name)} for values in (%s)",
+        (key,),
+    )
+    cursor.execute(f'alter table {qualified(schema, new_name)} drop constraint "{new_name}_key"')
+
+    cursor.execute(f'alter table {qualified(schema, new_name)} rename to "{name}"')
+    for suffix in [f"_t{i}" for i in range(len(TEMPO_PARTITION_BOUNDS) + 1)] + ["_tdefault"]:
+        cursor.execute(f'alter table {qualified(schema, new_name + suffix)} rename to "{name}{suffix}"')
+
+
+def check_encoder(table, encoder):
+    """Fail on loads of path dictionary ids without the encoder holding their dictionaries"""
+    if table in ENCODED_TABLES and encoder is None:
+        raise ValueError(f"{table} loads need a CombinationEncoder: its track and stem ids refer to the "
+                         "path dictionaries loaded with them")
+
+
+def encode_rows(header, rows, encoder):
+    """Yield the values of path-based combination rows with the paths replaced by dictionary ids"""
+    for values in rows:
+        row = encoder.encode_row(dict(zip(header, values)))
+        yield [row[column] for column in ENCODED_COMBINATION_COLUMNS]
+
+
+def load_path_dictionaries(cursor, schema, encoder):
+    """Replace the track_paths and stem_paths tables with the encoder's dictionaries"""
+    encoder.flush()
+    for table, dictionary in (("track_paths", encoder.track_paths), ("stem_paths", encoder.stem_paths)):
+        with open(dictionary.path, newline="") as f:
+            header = next(csv.reader(f))
+            _copy(cursor, schema, table, header, csv.reader(f), append=False)
+
+
+def _copy(cursor, schema, table, columns, rows, append, partitioned=False, replace_key=None, encoder=None):
+    """COPY rows (lists of values for columns) into schema.table, returning (rows, batch id)
+
+    With an encoder the path dictionaries are loaded after the rows, see load_path_dictionaries.
+    """
+    partitioned = partitioned or replace_key is not None or relation_kind(cursor, schema, table) == "p"
+    if partitioned:
+        ensure_partitioned_table(cursor, schema, table)
+    else:
+        ensure_table(cursor, schema, table)
+    load_batch_id = None
+    if table in BATCHED_TABLES:
+        load_batch_id = next_load_batch_id(cursor, schema, table)
+        columns = columns + ["load_batch_id"]
+        rows = (row + [load_batch_id] for row in rows)
+    if not append and replace_key is None:
+        cursor.execute(f"truncate {qualified(schema, table)}")
+
+    # Partitioned loads go through a temporary table and pick up key/tempo from the metadata
+    target = qualified(schema, table)
+    if partitioned:
+        target = f'"load_{table}"'
+        cursor.execute(f"create temporary table {target} (like {qualified(schema, table)}) on commit drop")
+
+    column_list = ", ".join(f'"{name}"' for name in columns)
+    cursor.copy_expert(
+        f"copy {target} ({column_list}) from stdin with (format csv)",
+        RowStream(rows),
+    )
+    rowcount = cursor.rowcount
+    if encoder is not None:
+        # All rows are encoded once COPY has consumed them
+        load_path_dictionaries(cursor, schema, encoder)
+
+    if partitioned:
+        select_sql = (
+            "select " + ", ".join(f'l."{name}"' for name in columns) + ', t."key", t."tempo" '
+            f"from {target} l left join {qualified(schema, 'track_paths')} p on l.track_id = p.track_id "
+            f"left join {qualified(schema, 'track_metadata')} t on p.track_path = t.track_path"
+        )
+        insert_columns = f'{column_list}, "key", "tempo"'
+        if replace_key is not None:
+            cursor.execute(f"select count(*) from ({select_sql}) s where s.key is distinct from %s", (replace_key,))
+            others = cursor.fetchone()[0]
+            if others:
+                raise ValueError(f"{others} rows do not belong to key {replace_key!r}")
+            swap_key_partition(cursor, schema, table, replace_key, f"({insert_columns}) {select_sql}")
+        else:
+            cursor.execute(f"select distinct key from ({select_sql}) s where s.key is not null")
+            for (key,) in cursor.fetchall():
+                ensure_key_partition(cursor, schema, table, key)
+            cursor.execute(f"insert into {qualified(schema, table)} ({insert_columns}) {select_sql}")
+
+    # Indexes are built after the first COPY into an empty table, which is faster
+    ensure_indexes(cursor, schema, table)
+    cursor.execute(f"analyze {qualified(schema, table)}")
+    return rowcount, load_batch_id
+
+
+def copy_csv(conn, table, path_or_file, schema=DEFAULT_SCHEMA, append=False, partitioned=False, replace_key=None,
+             encoder=None):
+    """COPY a CSV file (with a header row) into schema.table, replacing its rows unless append
+
+    partitioned creates the table partitioned by key and tempo; replace_key only
+    replaces the partition of that key (see swap_key_partition). stem_combinations
+    loads need a CombinationEncoder, which encodes path-based rows and whose
+    dictionaries are loaded with them. Returns the number of rows loaded and the
+    load_batch_id (None for unbatched tables).
+    """
+    check_encoder(table, encoder)
+    stream = open(path_or_file, newline="") if isinstance(path_or_file, str) else path_or_file
+    try:
+        reader = csv.reader(stream)
+        header = next(reader)
+        if encoder is not None and PATH_COLUMNS <= set(header):
+            reader = encode_rows(header, reader, encoder)
+            header = ENCODED_COMBINATION_COLUMNS
+        known = {name for name, _ in TABLE_COLUMNS[table]}
+        unknown = [column for column in header if column not in known]
+        if unknown:
+            raise ValueError(f"Unexpected columns for {table}: {unknown}")
+
+        with conn.cursor() as cursor:
+            result = _copy(cursor, schema, table, header, reader, append, partitioned, replace_key, encoder)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if stream is not path_or_file:
+            stream.close()
+
+
+def copy_rows(conn, table, rows, schema=DEFAULT_SCHEMA, append=True, encoder=None):
+    """COPY an iterable of row dicts (e.g. generated combinations) into schema.table
+
+    With an encoder, path-based combination rows are encoded as in copy_csv. Returns
+    the number of rows loaded and the load_batch_id (None for unbatched tables).
+    """
+    check_encoder(table, encoder)
+    columns = [name for name, _ in TABLE_COLUMNS[table]]
+    if encoder is not None:
+        rows = (row if "track_id" in row else encoder.encode_row(row) for row in rows)
+    values = ([row.get(column) for column in columns] for row in rows)
+    try:
+        with conn.cursor() as cursor:
+            result = _copy(cursor, schema, table, columns, values, append, encoder=encoder)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="COPY stem combinations and track metadata into Postgres")
+    parser.add_argument("--combinations", default="sheets/stem_combinations3.csv",
+                        help="Combinations CSV from get_combinations.py ('-' for stdin, '' to skip)")
+    parser.add_argument("--metadata", default="music_stems/seeds/track_metadata.csv",
+                        help="Track metadata CSV from extract_metadata.py ('-' for stdin, '' to skip)")
+    parser.add_argument("--schema", default=DEFAULT_SCHEMA)
+    parser.add_argument("--append", action="store_true", help="Append instead of replacing the table contents")
+    parser.add_argument("--cluster", action="store_true",
+                        help="CLUSTER stem_combinations on track_id after loading (locks the table)")
+    parser.add_argument("--partitioned", action="store_true",
+                        help="Create stem_combinations partitioned by key and tempo range")
+    parser.add_argument("--replace-key", default=None,
+                        help="Atomically replace the partition of this key with the combinations CSV")
+    parser.add_argument("--track-paths", default=DEFAULT_TRACK_PATHS,
+                        help="Track path dictionary of the combinations (extended by path-based CSVs)")
+    parser.add_argument("--stem-paths", default=DEFAULT_STEM_PATHS,
+                        help="Stem path dictionary of the combinations (extended by path-based CSVs)")
+    args = parser.parse_args(argv)
+
+    conn = connect()
+    encoder = CombinationEncoder.open(args.track_paths, args.stem_paths) if args.combinations else None
+    try:
+        # Metadata first, partitioned combinations take their key and tempo from it
+        for table, path in (("track_metadata", args.metadata), ("stem_combinations", args.combinations)):
+            if not path:
+                continue
+            source = sys.stdin if path == "-" else path
+            options = {}
+            if table == "stem_combinations":
+                options = {"partitioned": args.partitioned, "replace_key": args.replace_key, "encoder": encoder}
+            rows, load_batch_id = copy_csv(conn, table, source, schema=args.schema, append=args.append, **options)
+            batch = f" (load batch {load_batch_id})" if load_batch_id is not None else ""
+            print(f"✓ Loaded {rows} rows into {args.schema}.{table}{batch}")
+        if encoder is not None:
+            print(f"✓ Loaded {len(encoder.track_paths)} track paths and {len(encoder.stem_paths)} stem paths")
+        if args.cluster:
+            cluster_table(conn, "stem_combinations", schema=args.schema)
+            print(f"✓ Clustered {args.schema}.stem_combinations on track_id")
+    finally:
+        if encoder is not None:
+            encoder.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
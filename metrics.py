@@ -0,0 +1,268 @@
+"""
+Run metrics for get_combinations.py: counters and histograms (timings, candidate
+counts) with optional labels, summarized as JSON or written as a Prometheus textfile.
+
+Metrics are off by default: get_metrics() returns a NullMetrics whose methods do
+nothing, so instrumented code only pays for a method call. enable_metrics() installs
+a recording Metrics instance. Worker processes record into their own instance and
+hand their samples to the parent with drain()/merge().
+
+Usage:
+    metrics = get_metrics()
+    with metrics.timer("search_seconds"):
+        ...
+    metrics.observe("candidates_per_track", len(similar_tracks))
+    metrics.inc("combinations_total", len(rows), similarity_threshold=0.7)
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds, the last bucket being +Inf
+SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                   5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+METRIC_PREFIX = "stem_combinations_"
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    labels = list(label_key) + list(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Histogram:
+    """Bucketed distribution of observed values, plus their count, sum, min and max"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None or value < self.min else self.min
+                self.max = value if self.max is None or value > self.max else self.max
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (max for the +Inf bucket)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, SECONDS_BUCKETS, **self.labels)
+        return False
+
+
+class Metrics:
+    """Thread-safe counters and histograms keyed by name and labels"""
+
+    enabled = True
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=COUNT_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """Context manager observing its duration in the name histogram (seconds)"""
+        return _Timer(self, name, labels)
+
+    def drain(self):
+        """Return the samples recorded so far and start over, see merge()"""
+        with self._lock:
+            samples = (self.counters, self.histograms)
+            self.counters, self.histograms = {}, {}
+        return samples
+
+    def merge(self, samples):
+        """Add the samples drained from another Metrics, e.g. of a worker process"""
+        counters, histograms = samples
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, histogram in histograms.items():
+                if key in self.histograms:
+                    self.histograms[key].merge(histogram)
+                else:
+                    self.histograms[key] = histogram
+
+    def summary(self):
+        """Return every metric as a JSON-serializable dict"""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: histogram.summary() for key, histogram in self.histograms.items()}
+
+        def named(key):
+            name, label_key = key
+            return name + _format_labels(label_key)
+
+        return {
+            "elapsed_seconds": round(time.time() - self.started, 3),
+            "counters": {named(key): value for key, value in sorted(counters.items())},
+            "histograms": {named(key): value for key, value in sorted(histograms.items())},
+        }
+
+    def write_json(self, path, **extra):
+        """Write summary() plus the extra fields to path"""
+        with open(path, "w") as f:
+            json.dump({**extra, **self.summary()}, f, indent=2)
+            f.write("\n")
+
+    def prometheus_text(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+
+        lines = []
+        typed = set()
+        for (name, label_key), value in counters:
+            metric = METRIC_PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_format_labels(label_key)} {value}")
+        for (name, label_key), histogram in histograms:
+            metric = METRIC_PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_format_labels(label_key, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(label_key)} {histogram.sum}")
+            lines.append(f"{metric}_count{_format_labels(label_key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the metrics as a node_exporter textfile collector file"""
+        # The collector may read the file at any time, so replace it atomically
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics:
+    """Metrics API that records nothing, used while metrics are disabled"""
+
+    enabled = False
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, buckets=COUNT_BUCKETS, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return _NULL_TIMER
+
+    def drain(self):
+        return {}, {}
+
+    def merge(self, samples):
+        pass
+
+
+_metrics = NullMetrics()
+
+
+def get_metrics():
+    """Return the process-wide metrics, a NullMetrics unless enable_metrics() was called"""
+    return _metrics
+
+
+def enable_metrics():
+    """Start recording metrics in this process and return the new Metrics instance
+
+    Any samples recorded before are dropped, including the ones a forked worker
+    process inherited from its parent.
+    """
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def disable_metrics():
+    global _metrics
+    _metrics = NullMetrics()
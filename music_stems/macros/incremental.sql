@@ -0,0 +1,8 @@
+{% macro new_batch_tracks(upstream, batch_column='track_load_batch_id', upstream_batch_column=none) %}
+    -- Tracks with rows in load batches newer than the last run of the current model
+    select distinct track_id
+    from {{ upstream }}
+    where {{ upstream_batch_column or batch_column }} > (
+        select coalesce(max({{ batch_column }}), -1) from {{ this }}
+    )
+{% endmacro %}
@@ -0,0 +1,4 @@
+{% macro analyze_relation(relation=none) %}
+    -- Refresh planner statistics after a (re)build, e.g. as a post-hook
+    analyze {{ relation or this }}
+{% endmacro %}
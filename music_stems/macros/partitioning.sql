@@ -0,0 +1,64 @@
+{% macro postgres__create_table_as(temporary, relation, sql) -%}
+    {#- Models configured with key_tempo_partitioned=true are built as partitioned tables -#}
+    {%- if not temporary and config.get('key_tempo_partitioned', false) -%}
+        {{ create_key_tempo_partitioned_table_as(relation, sql) }}
+    {%- else -%}
+        {{ dbt.postgres__create_table_as(temporary, relation, sql) }}
+    {%- endif -%}
+{%- endmacro %}
+
+
+{% macro create_key_tempo_partitioned_table_as(relation, sql) %}
+    {#-
+        List partition by key, with one sub-partition per tempo range (split at the
+        tempo_partition_bounds var) and a default one for missing tempos. Key
+        partitions are created for the keys present in the data; rows with a null key
+        or, on incremental runs, a key first seen after the build go to the default
+        partition. Partition names carry the invocation id, since dbt builds the new
+        table next to the one it replaces.
+    -#}
+    {%- set bounds = var('tempo_partition_bounds', [80, 110, 140]) -%}
+    {%- set source = relation.identifier ~ '__partition_source' -%}
+    {%- set prefix = relation.identifier.replace('__dbt_tmp', '')[:32] ~ '_' ~ invocation_id[:8] -%}
+
+    create temporary table "{{ source }}" on commit drop as (
+        {{ sql }}
+    );
+
+    create table {{ relation }} (like "{{ source }}") partition by list (key);
+
+    create table {{ relation.incorporate(path={'identifier': prefix ~ '_default'}) }}
+        partition of {{ relation }} default;
+
+    do $$
+    declare
+        partition_key text;
+        partition_name text;
+        bounds integer[] := array[{{ bounds | join(', ') }}]::integer[];
+        i integer;
+    begin
+        for partition_key in select distinct key from "{{ source }}" where key is not null loop
+            partition_name := '{{ prefix }}_'
+                || regexp_replace(lower(replace(partition_key, '#', 's')), '[^a-z0-9]+', '_', 'g');
+            execute format(
+                'create table %I.%I partition of %s for values in (%L) partition by range (tempo)',
+                '{{ relation.schema }}', partition_name, '{{ relation }}', partition_key
+            );
+            for i in 0 .. coalesce(array_length(bounds, 1), 0) loop
+                execute format(
+                    'create table %I.%I partition of %I.%I for values from (%s) to (%s)',
+                    '{{ relation.schema }}', partition_name || '_t' || i,
+                    '{{ relation.schema }}', partition_name,
+                    case when i = 0 then 'minvalue' else bounds[i]::text end,
+                    case when i = coalesce(array_length(bounds, 1), 0) then 'maxvalue' else bounds[i + 1]::text end
+                );
+            end loop;
+            execute format(
+                'create table %I.%I partition of %I.%I default',
+                '{{ relation.schema }}', partition_name || '_tdefault', '{{ relation.schema }}', partition_name
+            );
+        end loop;
+    end $$;
+
+    insert into {{ relation }} select * from "{{ source }}"
+{% endmacro %}
@@ -1,20 +1,32 @@
 {{
     config(
-        materialized='view'
+        materialized='incremental',
+        unique_key='track_id',
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['track_id']},
+            {'columns': ['track_load_batch_id']}
+        ],
+        post_hook="{{ analyze_relation() }}"
     )
 }}
 
 with scored_combinations as (
     select * from {{ ref('int_quality_scored') }}
+    {% if is_incremental() %}
+    where track_id in ({{ new_batch_tracks(ref('int_quality_scored'), upstream_batch_column='load_batch_id') }})
+    {% endif %}
 ),
 
 ranked as (
     select
         *,
         row_number() over (
-            partition by track_path, replaced_stem_type
+            partition by track_id, replaced_stem_type
             order by composite_quality_score desc, similarity_score desc
-        ) as rank_within_stem
+        ) as rank_within_stem,
+        -- Latest load batch of the track, kept on every row to drive incremental runs
+        max(load_batch_id) over (partition by track_id) as track_load_batch_id
     from scored_combinations
 ),
 
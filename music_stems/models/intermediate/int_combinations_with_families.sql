@@ -8,20 +8,22 @@ with combinations as (
     select * from {{ ref('int_combinations_with_metadata') }}
 ),
 
-stem_families as (
-    select * from {{ ref('stem_family_mapping') }}
+stem_dimension as (
+    select * from {{ ref('stg_stem_dimension') }}
 ),
 
 with_families as (
     select
         c.*,
-        f1.stem_family as replaced_stem_family,
-        f2.stem_family as replacing_stem_family
+        d1.family_id as replaced_family_id,
+        d1.stem_family as replaced_stem_family,
+        d2.family_id as replacing_family_id,
+        d2.stem_family as replacing_stem_family
     from combinations c
-    left join stem_families f1
-        on lower(trim(c.replaced_stem_type)) = lower(trim(f1.stem_type))
-    left join stem_families f2
-        on lower(trim(c.replacing_stem_type)) = lower(trim(f2.stem_type))
+    left join stem_dimension d1
+        on c.replaced_stem_type = d1.stem_type
+    left join stem_dimension d2
+        on c.replacing_stem_type = d2.stem_type
 )
 
 select * from with_families
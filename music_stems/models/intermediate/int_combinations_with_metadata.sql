@@ -8,8 +8,27 @@ with combinations as (
     select * from {{ ref('stg_stem_combinations') }}
 ),
 
+track_paths as (
+    select * from {{ ref('stg_track_paths') }}
+),
+
 track_metadata as (
-    select * from {{ ref('track_metadata') }}
+    select * from {{ source('raw', 'track_metadata') }}
+),
+
+-- Metadata is keyed by path, so it is resolved to track_id once per track
+track_metadata_by_id as (
+    select
+        p.track_id,
+        t.genre,
+        t.mood,
+        t.energy,
+        t.key,
+        t.tempo,
+        t.source
+    from track_paths p
+    inner join track_metadata t
+        on p.track_path = t.track_path
 ),
 
 enriched as (
@@ -22,8 +41,8 @@ enriched as (
         t.tempo,
         t.source
     from combinations c
-    left join track_metadata t
-        on c.track_path = t.track_path
+    left join track_metadata_by_id t
+        on c.track_id = t.track_id
 )
 
 select * from enriched
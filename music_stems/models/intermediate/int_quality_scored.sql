@@ -1,11 +1,25 @@
 {{
     config(
-        materialized='view'
+        materialized='incremental',
+        unique_key='track_id',
+        incremental_strategy='delete+insert',
+        key_tempo_partitioned=true,
+        indexes=[
+            {'columns': ['track_id', 'replaced_stem_type', 'composite_quality_score desc', 'similarity_score desc']},
+            {'columns': ['load_batch_id']}
+        ],
+        post_hook="{{ analyze_relation() }}"
     )
 }}
 
+-- depends_on: {{ ref('stg_stem_combinations') }}
+
 with combinations as (
     select * from {{ ref('int_combinations_with_families') }}
+    {% if is_incremental() %}
+    -- Rescore every combination of the tracks touched by new load batches
+    where track_id in ({{ new_batch_tracks(ref('stg_stem_combinations'), 'load_batch_id') }})
+    {% endif %}
 ),
 
 scored as (
@@ -21,14 +35,14 @@ scored as (
 
         -- Compatibility flag - same family is generally safer
         case
-            when replaced_stem_family = replacing_stem_family then true
+            when replaced_family_id = replacing_family_id then true
             else false
         end as same_family_replacement,
 
         -- Calculate a composite quality score (0-100)
         round(
             (similarity_score * 70 +  -- 70% weight on similarity
-            case when replaced_stem_family = replacing_stem_family then 30 else 0 end) -- 30% bonus for same family
+            case when replaced_family_id = replacing_family_id then 30 else 0 end) -- 30% bonus for same family
         , 2) as composite_quality_score
 
     from combinations
@@ -1,16 +1,37 @@
 {{
     config(
-        materialized='table'
+        materialized='incremental',
+        unique_key='track_id',
+        incremental_strategy='delete+insert',
+        key_tempo_partitioned=true,
+        indexes=[
+            {'columns': ['track_id']},
+            {'columns': ['track_path']},
+            {'columns': ['track_load_batch_id']}
+        ]
     )
 }}
 
 with best_combinations as (
     select * from {{ ref('int_best_combinations_per_track') }}
+    {% if is_incremental() %}
+    where track_id in ({{ new_batch_tracks(ref('int_best_combinations_per_track')) }})
+    {% endif %}
 ),
 
+track_paths as (
+    select * from {{ ref('stg_track_paths') }}
+),
+
+stem_paths as (
+    select * from {{ ref('stg_stem_paths') }}
+),
+
+-- Paths are only joined back here, for the rows kept
 final as (
     select
-        track_path,
+        b.track_id,
+        t.track_path,
         genre,
         mood,
         energy,
@@ -20,14 +41,20 @@ final as (
         replaced_stem_family,
         replacing_stem_type,
         replacing_stem_family,
-        replacing_stem_path,
+        b.replacing_stem_id,
+        s.stem_path as replacing_stem_path,
         rank_within_stem,
         similarity_score,
         composite_quality_score,
         quality_tier,
         same_family_replacement,
-        similarity_category
-    from best_combinations
+        similarity_category,
+        track_load_batch_id
+    from best_combinations b
+    inner join track_paths t
+        on b.track_id = t.track_id
+    inner join stem_paths s
+        on b.replacing_stem_id = s.stem_id
 )
 
 select * from final
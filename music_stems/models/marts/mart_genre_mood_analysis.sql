@@ -1,9 +1,13 @@
 {{
     config(
-        materialized='table'
+        materialized='table',
+        pre_hook="set local enable_partitionwise_aggregate = on"
     )
 }}
 
+-- int_quality_scored is partitioned by key and tempo range, so each partition can
+-- be aggregated separately
+
 with combinations as (
     select * from {{ ref('int_quality_scored') }}
 ),
@@ -14,7 +18,7 @@ genre_mood_stats as (
         mood,
         energy,
         count(*) as total_combinations,
-        count(distinct track_path) as unique_tracks,
+        count(distinct track_id) as unique_tracks,
         count(distinct replaced_stem_type) as stem_types_replaced,
         count(distinct replacing_stem_type) as unique_replacement_stems,
         avg(similarity_score) as avg_similarity,
@@ -1,9 +1,13 @@
 {{
     config(
-        materialized='table'
+        materialized='table',
+        pre_hook="set local enable_partitionwise_aggregate = on"
     )
 }}
 
+-- int_quality_scored is partitioned by key and tempo range, so each partition can
+-- be aggregated separately
+
 with combinations as (
     select * from {{ ref('int_quality_scored') }}
 ),
@@ -20,7 +24,7 @@ key_tempo_groups as (
             else 'Unknown'
         end as tempo_range,
         count(*) as total_combinations,
-        count(distinct track_path) as unique_tracks,
+        count(distinct track_id) as unique_tracks,
         avg(similarity_score) as avg_similarity,
         avg(composite_quality_score) as avg_quality_score,
         count(case when quality_tier = 'excellent' then 1 end) as excellent_count,
@@ -8,29 +8,39 @@ with stem_combinations as (
     select * from {{ ref('stg_stem_combinations') }}
 ),
 
+stem_paths as (
+    select * from {{ ref('stg_stem_paths') }}
+),
+
 popular_stems as (
     select
         replacing_stem_type,
-        replacing_stem_path,
-        replacing_folder,
+        replacing_stem_id,
         count(*) as times_used_as_replacement,
-        count(distinct track_path) as unique_tracks,
+        count(distinct track_id) as unique_tracks,
         count(distinct replaced_stem_type) as stem_types_replaced,
         avg(similarity_score) as avg_similarity,
         max(similarity_score) as max_similarity
     from stem_combinations
-    group by replacing_stem_type, replacing_stem_path, replacing_folder
+    group by replacing_stem_type, replacing_stem_id
 )
 
+-- Paths are only joined back for the top 100 stems
 select
-    replacing_stem_type,
-    replacing_stem_path,
-    replacing_folder,
-    times_used_as_replacement,
-    unique_tracks,
-    stem_types_replaced,
-    round(avg_similarity::numeric, 3) as avg_similarity,
-    round(max_similarity::numeric, 3) as max_similarity
-from popular_stems
-order by times_used_as_replacement desc
-limit 100
+    p.replacing_stem_type,
+    s.stem_path as replacing_stem_path,
+    s.stem_folder as replacing_folder,
+    p.times_used_as_replacement,
+    p.unique_tracks,
+    p.stem_types_replaced,
+    round(p.avg_similarity::numeric, 3) as avg_similarity,
+    round(p.max_similarity::numeric, 3) as max_similarity
+from (
+    select *
+    from popular_stems
+    order by times_used_as_replacement desc
+    limit 100
+) p
+inner join stem_paths s
+    on p.replacing_stem_id = s.stem_id
+order by p.times_used_as_replacement desc
@@ -1,29 +1,45 @@
 {{
     config(
-        materialized='table'
+        materialized='incremental',
+        unique_key='track_id',
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['track_id']},
+            {'columns': ['track_path']},
+            {'columns': ['track_load_batch_id']}
+        ]
     )
 }}
 
 with stem_combinations as (
     select * from {{ ref('stg_stem_combinations') }}
+    {% if is_incremental() %}
+    where track_id in ({{ new_batch_tracks(ref('stg_stem_combinations'), upstream_batch_column='load_batch_id') }})
+    {% endif %}
+),
+
+track_paths as (
+    select * from {{ ref('stg_track_paths') }}
 ),
 
 track_stats as (
     select
-        track_path,
+        track_id,
         count(*) as total_replacement_options,
         count(distinct replaced_stem_type) as stems_with_replacements,
         count(distinct replacing_stem_type) as unique_replacing_stems,
         avg(similarity_score) as avg_similarity,
         max(similarity_score) as best_similarity,
         count(case when similarity_category = 'high' then 1 end) as high_quality_options,
-        count(case when similarity_category = 'medium' then 1 end) as medium_quality_options
+        count(case when similarity_category = 'medium' then 1 end) as medium_quality_options,
+        max(load_batch_id) as track_load_batch_id
     from stem_combinations
-    group by track_path
+    group by track_id
 )
 
 select
-    track_path,
+    s.track_id,
+    t.track_path,
     total_replacement_options,
     stems_with_replacements,
     unique_replacing_stems,
@@ -31,6 +47,9 @@ select
     round(best_similarity::numeric, 3) as best_similarity,
     high_quality_options,
     medium_quality_options,
-    round((high_quality_options::numeric / total_replacement_options * 100), 2) as pct_high_quality
-from track_stats
+    round((high_quality_options::numeric / total_replacement_options * 100), 2) as pct_high_quality,
+    track_load_batch_id
+from track_stats s
+inner join track_paths t
+    on s.track_id = t.track_id
 order by total_replacement_options desc
@@ -4,26 +4,32 @@
     )
 }}
 
+{%- set source_relation = source('raw', 'stem_combinations') -%}
+{%- set source_columns = adapter.get_columns_in_relation(source_relation) | map(attribute='name') | list %}
+
 with source as (
-    select * from {{ ref('stem_combinations') }}
+    select * from {{ source_relation }}
 ),
 
 renamed as (
     select
-        track_path,
+        track_id,
         replaced_stem_type,
         replacing_stem_type,
-        replacing_stem_path,
+        replacing_stem_id,
         similarity_score,
+        -- Seeded rows and tables loaded before batching belong to batch 0
+        {% if 'load_batch_id' in source_columns -%}
+        coalesce(load_batch_id, 0)
+        {%- else -%}
+        0
+        {%- endif %} as load_batch_id,
         -- Add computed fields
         case
             when similarity_score >= 0.9 then 'high'
             when similarity_score >= 0.75 then 'medium'
             else 'low'
-        end as similarity_category,
-        -- Extract folder from S3 path
-        split_part(track_path, '/', 4) as track_folder,
-        split_part(replacing_stem_path, '/', 4) as replacing_folder
+        end as similarity_category
     from source
 )
 
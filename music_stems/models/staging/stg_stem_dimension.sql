@@ -0,0 +1,31 @@
+{{
+    config(
+        materialized='table',
+        indexes=[
+            {'columns': ['stem_type'], 'unique': True}
+        ],
+        post_hook="{{ analyze_relation() }}"
+    )
+}}
+
+-- One row per raw stem type with the normalized type and family assigned by the
+-- Python stem classifier (build_stem_dimension.py), so combinations resolve their
+-- families with a plain equi-join
+
+with stem_dimension as (
+    select * from {{ ref('stem_dimension') }}
+),
+
+stem_families as (
+    select * from {{ ref('stem_families') }}
+)
+
+select
+    d.stem_type,
+    d.normalized_type,
+    d.normalized_type_id,
+    d.family_id,
+    f.stem_family
+from stem_dimension d
+left join stem_families f
+    on d.family_id = f.family_id
@@ -0,0 +1,18 @@
+{{
+    config(
+        materialized='view'
+    )
+}}
+
+-- One row per replacing_stem_id of the combinations (see path_dictionary.py)
+
+with source as (
+    select * from {{ source('raw', 'stem_paths') }}
+)
+
+select
+    stem_id,
+    stem_path,
+    -- Extract folder from S3 path
+    split_part(stem_path, '/', 4) as stem_folder
+from source
@@ -0,0 +1,19 @@
+{{
+    config(
+        materialized='view'
+    )
+}}
+
+-- One row per track_id of the combinations (see path_dictionary.py); paths are only
+-- joined back in the presentation marts
+
+with source as (
+    select * from {{ source('raw', 'track_paths') }}
+)
+
+select
+    track_id,
+    track_path,
+    -- Extract folder from S3 path
+    split_part(track_path, '/', 4) as track_folder
+from source
@@ -0,0 +1,200 @@
+"""
+On-disk cache of similarity search results for get_combinations.py.
+
+Results are stored in SQLite per (collection, key, tempo) partition, similarity
+threshold and query point id, together with a hash of the query vector and the
+search limit, so a re-run at the same threshold answers already searched tracks
+without a Qdrant round trip. A result also answers searches with a lower limit (its
+first hits), or with any limit when it holds fewer hits than its own limit.
+
+Exact duplicates are shared: when a search returns another point with a score of 1
+(a re-render of the same audio), that point's query is the same vector under the
+same key/tempo filter, so the result is also stored under its id. A stored result is
+only used when the vector hash of the track being searched matches, which makes the
+reuse safe even when the score is 1 only up to rounding.
+
+Each partition records the number of search candidates it had when its results were
+stored (see count_partition); when the collection gains or loses candidates in a
+partition its results are dropped. The least recently used results are evicted once
+the cache holds more than max_entries of them.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+# Same shape as the ScoredPoint attributes used by get_combinations.process_results
+CachedHit = namedtuple("CachedHit", ["id", "score", "payload", "vector"])
+
+SCHEMA = """
+create table if not exists neighbors (
+    collection text not null,
+    partition text not null,
+    threshold text not null,
+    point_id text not null,
+    vector_hash blob not null,
+    search_limit integer not null default 10,
+    hits blob not null,
+    last_used real not null,
+    primary key (collection, partition, threshold, point_id)
+);
+create index if not exists neighbors_last_used on neighbors (last_used);
+create table if not exists partitions (
+    collection text not null,
+    partition text not null,
+    candidates integer not null,
+    primary key (collection, partition)
+);
+"""
+
+
+def vector_hash(vector):
+    return hashlib.blake2b(np.asarray(vector, dtype=np.float32).tobytes(), digest_size=16).digest()
+
+
+def is_exact_match(score):
+    # Same test as get_combinations.filter_exact_matches
+    return bool(np.isclose(score, 1.0, atol=1e-8))
+
+
+class NeighborCache:
+    """Raw search hits by (key, tempo) partition, threshold and query point id
+
+    count_partition(key, tempo) returns the current number of search candidates of a
+    partition; it is called once per partition and run to detect stale results.
+    """
+
+    def __init__(self, path, collection, count_partition=None, max_entries=1_000_000, commit_every=500):
+        self.path = path
+        self.collection = collection
+        self.count_partition = count_partition
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+
+        self._validated = set()
+        self._writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Searches run on a thread pool; every access goes through self._lock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        columns = [row[1] for row in self._db.execute("pragma table_info(neighbors)")]
+        if "search_limit" not in columns:
+            # Caches written before the limit was configurable hold top-10 results
+            self._db.execute("alter table neighbors add column search_limit integer not null default 10")
+
+    @staticmethod
+    def _partition(key, tempo):
+        return json.dumps([key, tempo])
+
+    def _validate(self, partition, key, tempo):
+        """Drop the partition's results if its candidate count changed since they were stored
+
+        Called without self._lock: the count is a Qdrant round trip, so it runs outside
+        the lock and only the comparison and update take it. Threads that look up a new
+        partition at the same time may all count it; the first one to take the lock
+        validates it.
+        """
+        if partition in self._validated or self.count_partition is None:
+            return
+        candidates = self.count_partition(key, tempo)
+        with self._lock:
+            if partition in self._validated:
+                return
+            self._validated.add(partition)
+            row = self._db.execute(
+                "select candidates from partitions where collection = ? and partition = ?",
+                (self.collection, partition)
+            ).fetchone()
+            if row is not None and row[0] == candidates:
+                return
+            self._db.execute(
+                "delete from neighbors where collection = ? and partition = ?", (self.collection, partition)
+            )
+            self._db.execute(
+                "insert or replace into partitions (collection, partition, candidates) values (?, ?, ?)",
+                (self.collection, partition, candidates)
+            )
+            self._written()
+
+    def get(self, point_id, vector, key, tempo, threshold, limit=10):
+        """Return the cached raw hits of a query, or None"""
+        partition = self._partition(key, tempo)
+        entry = (self.collection, partition, repr(threshold), json.dumps(point_id))
+        self._validate(partition, key, tempo)
+        with self._lock:
+            row = self._db.execute(
+                "select vector_hash, search_limit, hits from neighbors "
+                "where collection = ? and partition = ? and threshold = ? and point_id = ?",
+                entry
+            ).fetchone()
+            hits = None
+            if row is not None and row[0] == vector_hash(vector):
+                hits = json.loads(zlib.decompress(row[2]))
+                if row[1] < limit and len(hits) == row[1]:
+                    # Searched with a lower limit and may be missing hits
+                    hits = None
+            if hits is None:
+                self.misses += 1
+                return None
+            self._db.execute(
+                "update neighbors set last_used = ? "
+                "where collection = ? and partition = ? and threshold = ? and point_id = ?",
+                (time.time(),) + entry
+            )
+            self._written()
+            self.hits += 1
+        return [CachedHit(hit_id, score, payload, None) for hit_id, score, payload in hits[:limit]]
+
+    def put(self, point_id, vector, key, tempo, threshold, hits, limit=10):
+        """Store the raw hits of a query, also under the ids of its exact duplicates"""
+        partition = self._partition(key, tempo)
+        blob = zlib.compress(json.dumps([[hit.id, hit.score, hit.payload] for hit in hits]).encode())
+        query_hash = vector_hash(vector)
+        point_ids = [point_id] + [hit.id for hit in hits if hit.id != point_id and is_exact_match(hit.score)]
+        now = time.time()
+        self._validate(partition, key, tempo)
+        with self._lock:
+            self._db.executemany(
+                "insert or replace into neighbors "
+                "(collection, partition, threshold, point_id, vector_hash, search_limit, hits, last_used) "
+                "values (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (self.collection, partition, repr(threshold), json.dumps(entry_id), query_hash, limit, blob, now)
+                    for entry_id in point_ids
+                ]
+            )
+            self._written(len(point_ids))
+
+    def _written(self, count=1):
+        self._writes += count
+        if self._writes >= self.commit_every:
+            self._evict()
+            self._db.commit()
+            self._writes = 0
+
+    def _evict(self):
+        (entries,) = self._db.execute("select count(*) from neighbors").fetchone()
+        if entries > self.max_entries:
+            self._db.execute(
+                "delete from neighbors where rowid in "
+                "(select rowid from neighbors order by last_used limit ?)",
+                (entries - self.max_entries,)
+            )
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._db.commit()
+            self._db.close()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Offline similarity search over an exported copy of the Qdrant collection.
+
+export_vectors() dumps the "audio" named vectors into a memory-mapped float32 matrix
+and the point ids/payloads into a JSON lines file. OfflineIndex then answers the same
+query as get_combinations.find_similar_tracks for every exported track - same key and
+tempo, found_stems >= 2, score above the similarity threshold, top SEARCH_LIMIT hits -
+with blocked cosine similarity inside each (key, tempo) partition, without any Qdrant
+traffic.
+
+Usage:
+    python offline_index.py export sheets/audio_index
+    python get_combinations.py --offline-index sheets/audio_index
+
+Output:
+    <prefix>.vectors.npy   float32 matrix, one row per point
+    <prefix>.points.jsonl  {"id": ..., "payload": {...}} per row
+    <prefix>.meta.json     collection, row count, dimension and distance
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+# Same shape as the ScoredPoint attributes used by get_combinations.process_results
+OfflineHit = namedtuple("OfflineHit", ["id", "score", "payload", "vector"])
+
+SUPPORTED_DISTANCES = ("Cosine", "Dot")
+
+
+def export_vectors(client, collection_name, prefix, vector_name="audio", batch_size=256):
+    """Export the vector_name vectors and payloads of a collection to prefix.* files"""
+    info = client.get_collection(collection_name)
+    vector_params = info.config.params.vectors[vector_name]
+    distance = getattr(vector_params.distance, "value", vector_params.distance)
+    if distance not in SUPPORTED_DISTANCES:
+        raise ValueError(f"Unsupported distance for offline search: {distance}")
+
+    count = client.count(collection_name=collection_name, exact=True).count
+    vectors = np.lib.format.open_memmap(
+        f"{prefix}.vectors.npy", mode="w+", dtype=np.float32, shape=(count, vector_params.size)
+    )
+
+    rows = 0
+    offset = None
+    with open(f"{prefix}.points.jsonl", "w") as points:
+        while rows < count:
+            results, offset = client.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=[vector_name]
+            )
+            for point in results[:count - rows]:
+                vector = (point.vector or {}).get(vector_name)
+                if vector is not None:
+                    vectors[rows] = vector
+                points.write(json.dumps({
+                    "id": point.id,
+                    "payload": point.payload,
+                    "has_vector": vector is not None
+                }) + "\n")
+                rows += 1
+            if not results or offset is None:
+                break
+    vectors.flush()
+
+    with open(f"{prefix}.meta.json", "w") as f:
+        json.dump({
+            "collection": collection_name,
+            "vector_name": vector_name,
+            "rows": rows,
+            "dim": vector_params.size,
+            "distance": distance,
+        }, f)
+    return rows
+
+
+class OfflineIndex:
+    """Exported vectors and payloads, searchable per (key, tempo) partition"""
+
+    def __init__(self, prefix):
+        with open(f"{prefix}.meta.json") as f:
+            self.meta = json.load(f)
+        rows = self.meta["rows"]
+        self.vectors = np.load(f"{prefix}.vectors.npy", mmap_mode="r")[:rows]
+
+        self.ids = []
+        self.payloads = []
+        self.has_vector = []
+        with open(f"{prefix}.points.jsonl") as f:
+            for line in f:
+                point = json.loads(line)
+                self.ids.append(point["id"])
+                self.payloads.append(point["payload"] or {})
+                self.has_vector.append(point["has_vector"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def track(self, row):
+        """Return row as a track dict shaped like get_combinations.fetch_all_tracks yields"""
+        vector = self.vectors[row].tolist() if self.has_vector[row] else None
+        return {
+            "id": self.ids[row],
+            "payload": self.payloads[row],
+            "vector": {self.meta["vector_name"]: vector},
+            "page_offset": None
+        }
+
+    def partitions(self):
+        """Return {(key, tempo): (query rows, candidate rows)}
+
+        Every track with a vector, key and tempo is a query of its partition; only
+        tracks with found_stems >= 2 are candidates, like the Qdrant search filter.
+        """
+        partitions = {}
+        for row, payload in enumerate(self.payloads):
+            key, tempo = payload.get("key"), payload.get("tempo")
+            if not (self.has_vector[row] and key and tempo):
+                continue
+            queries, candidates = partitions.setdefault((key, tempo), ([], []))
+            queries.append(row)
+            found_stems = payload.get("found_stems")
+            if isinstance(found_stems, (int, float)) and found_stems >= 2:
+                candidates.append(row)
+        return partitions
+
+    def _normalized(self, rows):
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.meta["distance"] == "Cosine":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    def search_all(self, similarity_threshold=0.7, limit=10, block_size=1024):
+        """Return the top-limit (rows, scores) above the threshold for every track
+
+        rows[i] lists the neighbor rows of track i by decreasing score, padded with -1.
+        Like the Qdrant search, the results still contain the query track itself.
+        """
+        neighbor_rows = np.full((len(self), limit), -1, dtype=np.int64)
+        neighbor_scores = np.zeros((len(self), limit), dtype=np.float32)
+
+        for queries, candidates in self.partitions().values():
+            if not candidates:
+                continue
+            candidates = np.array(candidates)
+            candidate_vectors = self._normalized(candidates)
+            for start in range(0, len(queries), block_size):
+                block = np.array(queries[start:start + block_size])
+                scores = self._normalized(block) @ candidate_vectors.T
+                scores[scores < similarity_threshold] = -np.inf
+
+                k = min(limit, scores.shape[1])
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                top_scores = np.take_along_axis(scores, top, axis=1)
+                order = np.argsort(-top_scores, axis=1, kind="stable")
+                top = np.take_along_axis(top, order, axis=1)
+                top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+                found = np.isfinite(top_scores)
+                neighbor_rows[block, :k] = np.where(found, candidates[top], -1)
+                neighbor_scores[block, :k] = np.where(found, top_scores, 0)
+
+        return neighbor_rows, neighbor_scores
+
+    def iter_similar(self, similarity_threshold=0.7, limit=10, block_size=1024):
+        """Yield (track, hits) for every exported track in export order
+
+        hits is None for tracks that cannot be searched (no vector, key or tempo).
+        """
+        neighbor_rows, neighbor_scores = self.search_all(similarity_threshold, limit, block_size)
+        partitioned = {row for queries, _ in self.partitions().values() for row in queries}
+        for row in range(len(self)):
+            if row not in partitioned:
+                yield self.track(row), None
+                continue
+            hits = [
+                OfflineHit(self.ids[neighbor], float(score), self.payloads[neighbor], None)
+                for neighbor, score in zip(neighbor_rows[row], neighbor_scores[row])
+                if neighbor >= 0
+            ]
+            yield self.track(row), hits
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export Qdrant vectors for offline similarity search")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("prefix", help="Path prefix of the exported files")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args(argv)
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from clients import get_vdb_client
+    from get_combinations import collection_name
+
+    rows = export_vectors(get_vdb_client(), collection_name, args.prefix, batch_size=args.batch_size)
+    print(f"Exported {rows} points to {args.prefix}.*")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Integer surrogate keys for the track and stem paths of the combination rows.
+
+A PathDictionary assigns dense integer ids to paths in the order they are first
+seen and appends every new (id, path) pair to its CSV file, so ids already written
+to combination rows never change. get_combinations.py --encode-paths and
+load_to_postgres.py share the dictionaries below, which are loaded into the
+track_paths and stem_paths raw tables next to stem_combinations.
+
+Usage:
+    encoder = CombinationEncoder.open()
+    rows = encoder.encode(combinations)  # ENCODED_COMBINATION_COLUMNS rows
+    encoder.flush()
+"""
+
+import csv
+import os
+
+DEFAULT_TRACK_PATHS = os.path.join("sheets", "track_paths.csv")
+DEFAULT_STEM_PATHS = os.path.join("sheets", "stem_paths.csv")
+
+# (id column, path column) of each dictionary, also the columns of its raw table
+TRACK_PATH_COLUMNS = ("track_id", "track_path")
+STEM_PATH_COLUMNS = ("stem_id", "stem_path")
+
+
+class PathDictionary:
+    """Append-only path -> integer id mapping persisted as a CSV file
+
+    With resume_size the file is first truncated to that many bytes (see tell()), which
+    drops the ids assigned after the last checkpoint of an interrupted run.
+    """
+
+    def __init__(self, path, columns, resume_size=None):
+        self.path = path
+        self.columns = columns
+        self.ids = {}
+
+        exists = os.path.exists(path)
+        if exists:
+            if resume_size is not None:
+                with open(path, 'r+', newline='') as f:
+                    f.truncate(resume_size)
+            with open(path, newline='') as f:
+                for row in csv.DictReader(f):
+                    self.ids[row[columns[1]]] = int(row[columns[0]])
+            if sorted(self.ids.values()) != list(range(1, len(self.ids) + 1)):
+                raise ValueError(f"{path} does not hold ids 1..{len(self.ids)}")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', newline='')
+        self._csv = csv.writer(self._file, lineterminator='\n')
+        if not exists or self._file.tell() == 0:
+            self._csv.writerow(columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def id(self, path):
+        """Return the id of path, assigning the next one if it is new"""
+        path_id = self.ids.get(path)
+        if path_id is None:
+            path_id = self.ids[path] = len(self.ids) + 1
+            self._csv.writerow([path_id, path])
+        return path_id
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def tell(self):
+        """Size of the file, to resume from with resume_size"""
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class CombinationEncoder:
+    """Encode get_combinations.py rows with a track path and a stem path dictionary"""
+
+    def __init__(self, track_paths, stem_paths):
+        self.track_paths = track_paths
+        self.stem_paths = stem_paths
+
+    @classmethod
+    def open(cls, track_paths_path=DEFAULT_TRACK_PATHS, stem_paths_path=DEFAULT_STEM_PATHS, resume_sizes=None):
+        track_size, stem_size = resume_sizes or (None, None)
+        return cls(
+            PathDictionary(track_paths_path, TRACK_PATH_COLUMNS, track_size),
+            PathDictionary(stem_paths_path, STEM_PATH_COLUMNS, stem_size)
+        )
+
+    def encode_row(self, row):
+        return {
+            'track_id': self.track_paths.id(row['track_path']),
+            'replaced_stem_type': row['replaced_stem_type'],
+            'replacing_stem_type': row['replacing_stem_type'],
+            'replacing_stem_id': self.stem_paths.id(row['replacing_stem_path']),
+            'similarity_score': row['similarity_score']
+        }
+
+    def encode(self, rows):
+        """Return the rows (dicts with COMBINATION_COLUMNS) as ENCODED_COMBINATION_COLUMNS dicts"""
+        return [self.encode_row(row) for row in rows]
+
+    def flush(self):
+        self.track_paths.flush()
+        self.stem_paths.flush()
+
+    def tell(self):
+        return [self.track_paths.tell(), self.stem_paths.tell()]
+
+    def close(self):
+        self.track_paths.close()
+        self.stem_paths.close()
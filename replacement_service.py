@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Low-latency lookups of the best replacements for a stem of a track, served from memory.
+
+The answers are precomputed by dbt in mart_best_replacements_per_track (top 3
+replacements per track and stem) and mart_replacement_recommendations (the
+recommendation for the best one). ReplacementIndex holds both marts in memory as
+track_id -> replaced stem type -> replacements in rank order, so a lookup is a couple
+of dict reads (microseconds) and never touches the warehouse.
+
+ReplacementService loads the index through a small pool of Postgres connections
+(queries run in worker threads, the event loop never blocks on them) and polls the
+marts every --refresh-interval seconds to pick up new dbt runs:
+- incremental runs delete+insert every row of the tracks they rebuild with a newer
+  track_load_batch_id, so only the rows above the highest batch id loaded so far are
+  fetched, and they replace those tracks as a whole;
+- a full refresh recreates the mart table (new table oid), which triggers a full
+  reload, dropping tracks that disappeared.
+Each mart is refreshed on its own; a recommendation is only served while its
+track_load_batch_id matches the track's, so a dbt run that is halfway through never
+pairs replacements and recommendations of different batches.
+
+The service answers HTTP GET requests (JSON, keep-alive):
+    /replacements?track_id=12&stem=drums       ranked replacements of one stem
+    /replacements?track_path=s3://...           every stem of a track
+    /health                                     index size, batch ids, last refresh
+
+Usage:
+    python replacement_service.py --port 8080
+    python replacement_service.py --refresh-interval 10 --schema music_stems_marts
+
+    service = ReplacementService()
+    await service.start()
+    service.index.lookup(12, "drums")
+
+Connection settings come from the POSTGRES_* environment variables (see
+load_to_postgres.py), the marts schema from MARTS_SCHEMA (default: music_stems_marts).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+from load_to_postgres import connection_settings, qualified
+
+DEFAULT_SCHEMA = os.getenv("MARTS_SCHEMA", "music_stems_marts")
+
+BEST_REPLACEMENTS = "mart_best_replacements_per_track"
+RECOMMENDATIONS = "mart_replacement_recommendations"
+
+# Columns of mart_best_replacements_per_track describing the track, repeated on its rows
+TRACK_COLUMNS = ("track_id", "track_path", "genre", "mood", "energy", "key", "tempo", "track_load_batch_id")
+
+Replacement = namedtuple("Replacement", [
+    "replacing_stem_type",
+    "replacing_stem_family",
+    "replacing_stem_id",
+    "replacing_stem_path",
+    "rank_within_stem",
+    "similarity_score",
+    "composite_quality_score",
+    "quality_tier",
+    "same_family_replacement",
+])
+
+# Numeric tempos and scores are read as floats instead of Decimals
+BEST_REPLACEMENTS_SELECT = ", ".join(
+    tuple("tempo::float8" if column == "tempo" else column for column in TRACK_COLUMNS)
+    + ("replaced_stem_type",)
+    + tuple(f"{field}::float8" if field.endswith("_score") else field for field in Replacement._fields)
+)
+RECOMMENDATIONS_SELECT = "track_id, track_load_batch_id, replaced_stem_type, recommendation, recommendation_priority"
+
+
+def _intern(value):
+    # Stem types, families, tiers and popular stem paths repeat across tracks
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class TrackReplacements:
+    """Replacements of one track: stems maps a replaced stem type to its ranked Replacements"""
+
+    __slots__ = TRACK_COLUMNS + ("stems",)
+
+    def __init__(self, track_id, track_path, genre, mood, energy, key, tempo, track_load_batch_id):
+        self.track_id = track_id
+        self.track_path = track_path
+        self.genre = genre
+        self.mood = mood
+        self.energy = energy
+        self.key = key
+        self.tempo = tempo
+        self.track_load_batch_id = track_load_batch_id
+        self.stems = {}
+
+
+def build_tracks(rows):
+    """Group BEST_REPLACEMENTS_SELECT rows into {track_id: TrackReplacements}"""
+    tracks = {}
+    split = len(TRACK_COLUMNS)
+    for row in rows:
+        track = tracks.get(row[0])
+        if track is None:
+            track = tracks[row[0]] = TrackReplacements(*map(_intern, row[:split]))
+        replacement = Replacement._make(map(_intern, row[split + 1:]))
+        track.stems.setdefault(_intern(row[split]), []).append(replacement)
+    for track in tracks.values():
+        for stem_type, replacements in track.stems.items():
+            track.stems[stem_type] = tuple(sorted(replacements, key=lambda r: r.rank_within_stem))
+    return tracks
+
+
+def build_recommendations(rows):
+    """Group RECOMMENDATIONS_SELECT rows into {track_id: (batch id, {stem type: (recommendation, priority)})}"""
+    recommendations = {}
+    for track_id, batch_id, stem_type, recommendation, priority in rows:
+        entry = recommendations.get(track_id)
+        if entry is None:
+            entry = recommendations[track_id] = (batch_id, {})
+        entry[1][_intern(stem_type)] = (_intern(recommendation), priority)
+    return recommendations
+
+
+class ReplacementIndex:
+    """In-memory replacements and recommendations per track, looked up by track id or path"""
+
+    def __init__(self):
+        self.tracks = {}
+        self.track_ids = {}
+        self.recommendations = {}
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def track(self, track):
+        """Return the TrackReplacements of a track id or path, or None"""
+        if isinstance(track, str):
+            track = self.track_ids.get(track)
+        return self.tracks.get(track)
+
+    def lookup(self, track, stem_type):
+        """Return the ranked Replacements of stem_type in track (empty if unknown)"""
+        entry = self.track(track)
+        if entry is None:
+            return ()
+        return entry.stems.get(stem_type, ())
+
+    def recommendation(self, track, stem_type):
+        """Return (recommendation, priority) for the best replacement of stem_type, or None"""
+        entry = self.track(track)
+        if entry is None:
+            return None
+        batch_id, stems = self.recommendations.get(entry.track_id, (None, {}))
+        if batch_id != entry.track_load_batch_id:
+            return None
+        return stems.get(stem_type)
+
+    def update_tracks(self, tracks, full=False):
+        """Replace the given tracks (or, with full, every track)"""
+        if full:
+            self.tracks = tracks
+            self.track_ids = {track.track_path: track_id for track_id, track in tracks.items()}
+            return
+        self.tracks.update(tracks)
+        self.track_ids.update((track.track_path, track_id) for track_id, track in tracks.items())
+
+    def update_recommendations(self, recommendations, full=False):
+        """Replace the recommendations of the given tracks (or, with full, of every track)"""
+        if full:
+            self.recommendations = recommendations
+        else:
+            self.recommendations.update(recommendations)
+
+
+class ReplacementService:
+    """Keep a ReplacementIndex in sync with the marts in schema
+
+    start() opens the connection pool, loads the index and, if refresh_interval is
+    set, polls for new dbt runs in the background. Rows are streamed in chunks of
+    itersize through a server-side cursor, so large loads do not need a second copy
+    of the mart in memory.
+    """
+
+    def __init__(self, schema=DEFAULT_SCHEMA, pool_size=2, refresh_interval=30.0, itersize=10000):
+        self.schema = schema
+        self.pool_size = pool_size
+        self.refresh_interval = refresh_interval
+        self.itersize = itersize
+        self.index = ReplacementIndex()
+        self.refreshed_at = None
+        # (table oid, highest track_load_batch_id loaded) per mart
+        self._loaded = {BEST_REPLACEMENTS: (None, -1), RECOMMENDATIONS: (None, -1)}
+        self._pool = None
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task = None
+
+    async def start(self):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self._pool = await asyncio.to_thread(ThreadedConnectionPool, 1, self.pool_size, **connection_settings())
+        await self.refresh()
+        if self.refresh_interval:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+        if self._pool is not None:
+            self._pool.closeall()
+
+    async def refresh(self):
+        """Load the rows of dbt runs newer than the index, return the number of tracks updated per mart"""
+        async with self._refresh_lock:
+            best, recommendations = await asyncio.gather(
+                asyncio.to_thread(self._fetch_changes, BEST_REPLACEMENTS, BEST_REPLACEMENTS_SELECT, build_tracks),
+                asyncio.to_thread(self._fetch_changes, RECOMMENDATIONS, RECOMMENDATIONS_SELECT, build_recommendations),
+            )
+            # Both marts are swapped in on the event loop, between two lookups
+            updated = {}
+            for table, changes, update in ((BEST_REPLACEMENTS, best, self.index.update_tracks),
+                                           (RECOMMENDATIONS, recommendations, self.index.update_recommendations)):
+                updated[table] = 0
+                if changes is None:
+                    continue
+                oid, batch_id, full, entries = changes
+                update(entries, full=full)
+                self._loaded[table] = (oid, batch_id)
+                updated[table] = len(entries)
+            self.refreshed_at = time.time()
+            return updated
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                updated = await self.refresh()
+            except Exception as e:
+                # Keep serving the index loaded so far
+                print(f"Error refreshing replacements: {e}", file=sys.stderr)
+                continue
+            if any(updated.values()):
+                print(f"✓ Refreshed {updated[BEST_REPLACEMENTS]} tracks, "
+                      f"{updated[RECOMMENDATIONS]} track recommendations", file=sys.stderr)
+
+    def _fetch_changes(self, table, select, build):
+        """Return (oid, batch id, full, build(rows)) for the rows of table not loaded yet, or None
+
+        Runs in a worker thread. The oid, the highest batch id and the rows are read in
+        one repeatable read transaction, so rows committed by a concurrent dbt run are
+        either all included or left for the next refresh.
+        """
+        loaded_oid, loaded_batch_id = self._loaded[table]
+        relation = qualified(self.schema, table)
+        conn = self._pool.getconn()
+        try:
+            conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT to_regclass(%s)::oid", (relation,))
+                    oid = cursor.fetchone()[0]
+                    if oid is None:
+                        if loaded_oid is None:
+                            print(f"Warning: {relation} does not exist yet, run dbt first", file=sys.stderr)
+                        return None
+                    cursor.execute(f"SELECT coalesce(max(track_load_batch_id), -1) FROM {relation}")
+                    batch_id = cursor.fetchone()[0]
+                full = oid != loaded_oid
+                if not full and batch_id <= loaded_batch_id:
+                    return None
+                with conn.cursor(name=f"load_{table}") as cursor:
+                    cursor.itersize = self.itersize
+                    if full:
+                        cursor.execute(f"SELECT {select} FROM {relation}")
+                    else:
+                        cursor.execute(f"SELECT {select} FROM {relation} WHERE track_load_batch_id > %s",
+                                       (loaded_batch_id,))
+                    return oid, batch_id, full, build(cursor)
+        finally:
+            self._pool.putconn(conn)
+
+    def health(self):
+        return {
+            "tracks": len(self.index),
+            "loaded_batch_ids": {table: batch_id for table, (_, batch_id) in self._loaded.items()},
+            "refreshed_at": self.refreshed_at,
+        }
+
+
+def replacement_dicts(index, track, stem_type):
+    recommendation = index.recommendation(track, stem_type) or (None, None)
+    return {
+        "recommendation": recommendation[0],
+        "recommendation_priority": recommendation[1],
+        "replacements": [replacement._asdict() for replacement in index.lookup(track, stem_type)],
+    }
+
+
+def handle_request(service, target):
+    """Return (HTTP status, JSON payload) for a GET of target"""
+    url = urlsplit(target)
+    if url.path == "/health":
+        return 200, service.health()
+    if url.path != "/replacements":
+        return 404, {"error": f"Unknown path {url.path}"}
+
+    params = {name: values[0] for name, values in parse_qs(url.query).items()}
+    track = params.get("track_path")
+    if "track_id" in params:
+        try:
+            track = int(params["track_id"])
+        except ValueError:
+            return 400, {"error": "track_id must be an integer"}
+    if track is None:
+        return 400, {"error": "Pass track_id or track_path"}
+
+    entry = service.index.track(track)
+    if entry is None:
+        return 404, {"error": f"Track {track} not found"}
+    payload = {column: getattr(entry, column) for column in TRACK_COLUMNS}
+    stem_type = params.get("stem")
+    if stem_type is None:
+        payload["stems"] = {stem: replacement_dicts(service.index, entry.track_id, stem) for stem in entry.stems}
+    elif stem_type in entry.stems:
+        payload["replaced_stem_type"] = stem_type
+        payload.update(replacement_dicts(service.index, entry.track_id, stem_type))
+    else:
+        return 404, {"error": f"Track {track} has no replacements for stem {stem_type}"}
+    return 200, payload
+
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+async def serve_connection(service, reader, writer):
+    """Answer HTTP/1.1 GET requests on one connection until the client closes it"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, version = request_line.decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip().lower()
+
+            if method == "GET":
+                status, payload = handle_request(service, target)
+            else:
+                status, payload = 405, {"error": "Only GET is supported"}
+            body = json.dumps(payload).encode()
+            keep_alive = version == "HTTP/1.1" and headers.get("connection") != "close"
+            writer.write(
+                f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError):
+        # Reset connections and malformed request lines just close the connection
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(service, host="127.0.0.1", port=8080):
+    return await asyncio.start_server(lambda reader, writer: serve_connection(service, reader, writer), host, port)
+
+
+async def serve(args):
+    service = ReplacementService(schema=args.schema, pool_size=args.pool_size,
+                                 refresh_interval=args.refresh_interval)
+    await service.start()
+    print(f"✓ Loaded replacements of {len(service.index)} tracks from {args.schema}")
+    server = await start_server(service, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the best replacements per track and stem from memory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--schema", default=DEFAULT_SCHEMA, help="Schema of the dbt marts")
+    parser.add_argument("--refresh-interval", type=float, default=30.0,
+                        help="Seconds between polls for new dbt runs (0 to load once)")
+    parser.add_argument("--pool-size", type=int, default=2, help="Postgres connections kept in the pool")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
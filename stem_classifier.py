@@ -0,0 +1,340 @@
+"""
+Compiled, memoized stem name normalization and family classification.
+
+StemClassifier gives the same answers as normalize_stem_name, get_stem_family and
+are_stems_compatible in get_combinations.py, but compiles the normalization patterns
+once, pre-normalizes the family mapping and caches answers per raw stem string.
+CompatibilityContext holds the family mapping and the compatibility matrix as a
+dense family id x family id boolean array, so it can be loaded once per process
+and handed to worker processes without re-parsing matrix.csv.
+
+StemDimension is the classifier's answer for every distinct stem type seen in the
+data (stem_type -> normalized_type, normalized_type_id, family_id), written as the
+stem_dimension/stem_families seeds of the music_stems dbt project by
+build_stem_dimension.py. A classifier seeded with it resolves those stem types with
+a dictionary lookup, and dbt joins the same table instead of re-deriving families.
+"""
+
+import csv
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# Prefixes/suffixes that don't affect instrument identity
+STEM_QUALIFIERS_PATTERN = r'\b(full|dry|wet|clean|distorted|heavy|light|soft|hard)\b'
+
+# Normalize common variations, applied in order
+STEM_NAME_REPLACEMENTS = {
+    # Piano variations
+    r'\b(acoustic\s*piano|grand\s*piano|upright\s*piano)\b': 'piano',
+    r'\bpno\b': 'piano',
+    r'\bgrand\b': 'piano',
+
+    # Electric piano variations
+    r'\b(electric\s*piano|e\.?piano|e\.?p\.?)\b': 'ep',
+    r'\b(fender\s*)?rhodes\b': 'rhodes',
+    r'\b(wurlitzer|wurly)\b': 'wurli',
+
+    # Bass variations
+    r'\b(acoustic\s*bass|upright\s*bass|double\s*bass|standup\s*bass)\b': 'upright bass',
+    r'\b(electric\s*bass|bass\s*guitar|e\.?bass)\b': 'electric bass',
+    r'\b(synthesizer\s*bass|synth\s*bass|sub\s*bass)\b': 'synth bass',
+    r'\b(808\s*bass|808\s*sub)\b': '808',
+
+    # Guitar variations  
+    r'\b(acoustic\s*guitar|nylon\s*guitar|classical\s*guitar)\b': 'nylon',
+    r'\b(steel\s*string|steel\s*guitar|acoustic\s*steel)\b': 'steel',
+    r'\b(electric\s*guitar|e\.?guitar)\b': 'electric clean',
+    r'\b(jazz\s*guitar|clean\s*guitar)\b': 'jazz',
+    r'\b(muted\s*guitar|palm\s*muted)\b': 'muted',
+
+    # Drums variations
+    r'\b(drum\s*kit|full\s*kit|acoustic\s*drums|live\s*drums)\b': 'full kit',
+    r'\b(808\s*drums|tr\-?808|drum\s*machine)\b': '808 drums',
+    r'\b(percussion\s*loops?|perc\s*loops?)\b': 'perc loops',
+    r'\b(percussion|percussive)\b': 'perc',
+
+    # Synth variations
+    r'\b(pluck\s*lead|plucked\s*lead)\b': 'pluck lead',
+    r'\b(saw\s*lead|sawtooth\s*lead)\b': 'saw lead',
+    r'\b(arp\s*lead|arpeggio\s*lead|arpeggiated\s*lead)\b': 'arp-lead',
+    r'\b(synthesizer|synth)\b': 'synth',
+
+    # Organ variations
+    r'\b(hammond\s*organ|b3\s*organ)\b': 'organ',
+    r'\b(clavinet|clav)\b': 'clav',
+}
+
+DEFAULT_DIMENSION_PATH = os.path.join("music_stems", "seeds", "stem_dimension.csv")
+DEFAULT_FAMILIES_PATH = os.path.join("music_stems", "seeds", "stem_families.csv")
+
+StemDimensionRow = namedtuple("StemDimensionRow", ["normalized_type", "normalized_type_id", "family_id"])
+
+
+class CompatibilityContext:
+    """Stem family mapping plus the family x family compatibility lookup
+
+    Families are numbered in family_mapping order, followed by any family that only
+    appears in the matrix. compatible[i, j] is True when matrix.csv says "YES" for
+    row family i and column family j.
+    """
+
+    def __init__(self, family_mapping, families, compatible, matrix_path=None, matrix_mtime=None):
+        self.family_mapping = family_mapping
+        self.families = families
+        self.family_ids = {family: family_id for family_id, family in enumerate(families)}
+        self.compatible = compatible
+        self.matrix_path = matrix_path
+        self.matrix_mtime = matrix_mtime
+
+    @classmethod
+    def load(cls, family_mapping, matrix_path):
+        """Build the context from a family mapping and the matrix.csv at matrix_path"""
+        matrix_mtime = os.stat(matrix_path).st_mtime
+        with open(matrix_path, newline='') as f:
+            rows = list(csv.reader(f))
+        columns = rows[0][1:]
+        cells = {row[0]: dict(zip(columns, row[1:])) for row in rows[1:]}
+
+        families = list(dict.fromkeys(family_mapping.values()))
+        for family in list(cells) + columns:
+            if family not in families:
+                families.append(family)
+
+        compatible = np.zeros((len(families), len(families)), dtype=bool)
+        for row_family, row in cells.items():
+            for column_family, value in row.items():
+                if value == "YES":
+                    compatible[families.index(row_family), families.index(column_family)] = True
+
+        return cls(family_mapping, families, compatible, matrix_path, matrix_mtime)
+
+    @classmethod
+    def from_family_mapping(cls, family_mapping):
+        """Build a context without a matrix, e.g. to classify stems only
+
+        Family ids match the ones of a context loaded with the same mapping, since the
+        mapping's families always come first.
+        """
+        families = list(dict.fromkeys(family_mapping.values()))
+        return cls(family_mapping, families, np.zeros((len(families), len(families)), dtype=bool))
+
+    def is_stale(self):
+        """Return True when matrix.csv was modified after this context was loaded"""
+        if self.matrix_path is None:
+            return False
+        try:
+            return os.stat(self.matrix_path).st_mtime != self.matrix_mtime
+        except OSError:
+            return False
+
+    def family_id(self, family):
+        """Return the integer id of a family, or -1 for None/unknown families"""
+        return self.family_ids.get(family, -1)
+
+    def are_families_compatible(self, family1, family2):
+        family_id1 = self.family_ids.get(family1)
+        family_id2 = self.family_ids.get(family2)
+        if family_id1 is None or family_id2 is None:
+            return False
+        return bool(self.compatible[family_id1, family_id2])
+
+
+class StemClassifier:
+    """Normalize stem names, resolve their family and check stem compatibility
+
+    context is the CompatibilityContext providing the family mapping and matrix.
+    Each lookup is cached in a bounded LRU cache of cache_size entries. Stem types
+    found in dimension (a StemDimension) skip normalization and family matching.
+    """
+
+    def __init__(self, context, cache_size=4096, dimension=None):
+        self.context = context
+        self.family_mapping = context.family_mapping
+        self.dimension = dimension
+
+        self._qualifiers = re.compile(STEM_QUALIFIERS_PATTERN)
+        self._replacements = [
+            (re.compile(pattern), replacement)
+            for pattern, replacement in STEM_NAME_REPLACEMENTS.items()
+        ]
+        self._punctuation = re.compile(r'[^\w\s\-]')
+        self._whitespace = re.compile(r'\s+')
+
+        # Partial matching walks the family keys in mapping order, so keep them as a list
+        self._normalized_keys = [
+            (self._normalize(key), family) for key, family in self.family_mapping.items()
+        ]
+
+        # Integer ids of the normalized stem types seen so far, see encode()
+        self.type_ids = {}
+        self.types = []
+
+        if dimension is not None:
+            if dimension.families != context.families[:len(dimension.families)]:
+                raise ValueError("Stem dimension families do not match the family mapping")
+            # Continue the dimension's type numbering for stems missing from it
+            self.types = list(dimension.types)
+            self.type_ids = {normalized: type_id for type_id, normalized in enumerate(self.types)}
+
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize)
+        self.family = lru_cache(maxsize=cache_size)(self._family)
+        self.compatible = lru_cache(maxsize=cache_size)(self._compatible)
+        self.encode = lru_cache(maxsize=cache_size)(self._encode)
+        self._normalized_family = lru_cache(maxsize=cache_size)(self._family_of_normalized)
+
+    def cache_info(self):
+        """Return the cache statistics of normalize, family and compatible"""
+        return {
+            "normalize": self.normalize.cache_info(),
+            "family": self.family.cache_info(),
+            "compatible": self.compatible.cache_info(),
+            "encode": self.encode.cache_info(),
+        }
+
+    def _normalize(self, stem_name):
+        if not stem_name:
+            return ""
+
+        if self.dimension is not None and stem_name in self.dimension.rows:
+            return self.dimension.rows[stem_name].normalized_type
+
+        normalized = self._qualifiers.sub('', stem_name.lower().strip())
+        for pattern, replacement in self._replacements:
+            normalized = pattern.sub(replacement, normalized)
+
+        normalized = self._punctuation.sub(' ', normalized)
+        return self._whitespace.sub(' ', normalized).strip()
+
+    def _family(self, stem_type):
+        if not stem_type:
+            return None
+        if self.dimension is not None and stem_type in self.dimension.rows:
+            return self.dimension.family(stem_type)
+        return self._normalized_family(self.normalize(stem_type))
+
+    def _family_of_normalized(self, normalized_stem):
+        # Direct match on normalized name
+        if normalized_stem in self.family_mapping:
+            return self.family_mapping[normalized_stem]
+
+        # Partial match - check if any family key is contained in the normalized stem type
+        for normalized_key, family in self._normalized_keys:
+            if normalized_key and (normalized_key in normalized_stem or normalized_stem in normalized_key):
+                return family
+
+        # Word-based matching for compound terms
+        for word in normalized_stem.split():
+            if word in self.family_mapping:
+                return self.family_mapping[word]
+
+        return None
+
+    def _encode(self, stem_type):
+        """Return the (normalized type id, family id) of a stem, family id -1 when unknown"""
+        if self.dimension is not None and stem_type in self.dimension.rows:
+            row = self.dimension.rows[stem_type]
+            return row.normalized_type_id, row.family_id
+
+        normalized = self.normalize(stem_type)
+        type_id = self.type_ids.get(normalized)
+        if type_id is None:
+            type_id = self.type_ids[normalized] = len(self.types)
+            self.types.append(normalized)
+        return type_id, self.context.family_id(self.family(stem_type))
+
+    def _compatible(self, stem1, stem2):
+        if not stem1 or not stem2:
+            return False, "none"
+
+        norm1 = self.normalize(stem1)
+        norm2 = self.normalize(stem2)
+
+        if norm1 == norm2:
+            return True, "exact"
+
+        if norm1 in norm2 or norm2 in norm1:
+            return True, "variation"
+
+        family1 = self.family(stem1)
+        family2 = self.family(stem2)
+
+        if family1 and family2:
+            if self.context.are_families_compatible(family1, family2):
+                return True, "matrix_compatible"
+
+            if family1 == family2:
+                return True, "same_family"
+
+        return False, "none"
+
+
+class StemDimension:
+    """Normalized type and family of every known raw stem type
+
+    rows maps stem_type to a StemDimensionRow; types lists the normalized types by
+    normalized_type_id and families the family names by family_id (-1: no family).
+    Ids are only ever appended, so a dimension extended with new stem types keeps
+    the ids already joined against.
+    """
+
+    def __init__(self, families, rows=None, types=None):
+        self.families = families
+        self.rows = rows if rows is not None else {}
+        self.types = types if types is not None else []
+
+    @classmethod
+    def load(cls, path=DEFAULT_DIMENSION_PATH, families_path=DEFAULT_FAMILIES_PATH):
+        with open(families_path, newline='') as f:
+            family_rows = sorted(csv.DictReader(f), key=lambda row: int(row['family_id']))
+        families = [row['stem_family'] for row in family_rows]
+
+        rows = {}
+        types = {}
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                type_id = int(row['normalized_type_id'])
+                family_id = int(row['family_id']) if row['family_id'] else -1
+                rows[row['stem_type']] = StemDimensionRow(row['normalized_type'], type_id, family_id)
+                types[type_id] = row['normalized_type']
+        return cls(families, rows, [types[type_id] for type_id in range(len(types))])
+
+    def family(self, stem_type):
+        family_id = self.rows[stem_type].family_id
+        return self.families[family_id] if family_id >= 0 else None
+
+    def add(self, classifier, stem_types):
+        """Classify the stem types missing from the dimension and return how many were added"""
+        if self.families != classifier.context.families[:len(self.families)]:
+            raise ValueError("Stem dimension families do not match the family mapping")
+        self.families = list(classifier.context.families)
+        type_ids = {normalized: type_id for type_id, normalized in enumerate(self.types)}
+
+        added = 0
+        for stem_type in stem_types:
+            if not stem_type or stem_type in self.rows:
+                continue
+            normalized = classifier.normalize(stem_type)
+            if normalized not in type_ids:
+                type_ids[normalized] = len(self.types)
+                self.types.append(normalized)
+            family_id = classifier.context.family_id(classifier.family(stem_type))
+            self.rows[stem_type] = StemDimensionRow(normalized, type_ids[normalized], family_id)
+            added += 1
+        return added
+
+    def write(self, path=DEFAULT_DIMENSION_PATH, families_path=DEFAULT_FAMILIES_PATH):
+        with open(families_path, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['family_id', 'stem_family'])
+            writer.writerows(enumerate(self.families))
+
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['stem_type', 'normalized_type', 'normalized_type_id', 'family_id'])
+            for stem_type, row in sorted(self.rows.items()):
+                family_id = row.family_id if row.family_id >= 0 else None
+                writer.writerow([stem_type, row.normalized_type, row.normalized_type_id, family_id])
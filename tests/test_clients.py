@@ -0,0 +1,106 @@
+"""Lazy Qdrant client construction and retries of clients.py, against QdrantClient(":memory:")."""
+
+import os
+import sys
+import threading
+
+import httpx
+import pytest
+from qdrant_client import QdrantClient, models
+from qdrant_client.http.exceptions import UnexpectedResponse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import clients
+
+
+@pytest.fixture(autouse=True)
+def memory_client(monkeypatch):
+    """Give every test a fresh configuration pointing at an in-memory instance"""
+    monkeypatch.setattr(clients, "_config", {**clients._config, "url": ":memory:", "retries": 3,
+                                             "retry_backoff": 0})
+    monkeypatch.setattr(clients, "_vdb_client", None)
+
+
+class Flaky:
+    """Callable raising the given errors in turn, then returning "ok" """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def unexpected_response(status_code):
+    return UnexpectedResponse(status_code, "error", b"", httpx.Headers())
+
+
+def test_client_is_built_once():
+    client = clients.get_vdb_client()
+    assert isinstance(client, QdrantClient)
+    assert clients.get_vdb_client() is client
+
+
+def test_client_is_shared_across_threads():
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(clients.get_vdb_client())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(seen) == 8
+    assert all(client is seen[0] for client in seen)
+
+
+def test_configure_replaces_client():
+    client = clients.get_vdb_client()
+    clients.configure_vdb_client(url=":memory:", timeout=None)
+    replaced = clients.get_vdb_client()
+    assert replaced is not client
+    assert clients.get_vdb_client() is replaced
+
+
+def test_configure_ignores_none_values():
+    clients.configure_vdb_client(retries=5, retry_backoff=None)
+    assert clients._config["retries"] == 5
+    assert clients._config["retry_backoff"] == 0
+
+
+def test_set_client_injects_client():
+    client = QdrantClient(":memory:")
+    client.create_collection("injected", vectors_config=models.VectorParams(size=4, distance=models.Distance.COSINE))
+    clients.set_vdb_client(client)
+    assert clients.get_vdb_client() is client
+    assert clients.get_vdb_client().collection_exists("injected")
+
+
+def test_with_retries_calls_client_method():
+    client = clients.get_vdb_client()
+    assert clients.with_retries(client.get_collections).collections == []
+
+
+@pytest.mark.parametrize("error", [ConnectionError(), TimeoutError(), unexpected_response(503),
+                                   unexpected_response(429), httpx.ConnectError("refused")])
+def test_with_retries_retries_transient_errors(error):
+    method = Flaky(error, error)
+    assert clients.with_retries(method) == "ok"
+    assert method.calls == 3
+
+
+def test_with_retries_raises_after_last_attempt():
+    method = Flaky(*[ConnectionError(f"attempt {i}") for i in range(5)])
+    with pytest.raises(ConnectionError, match="attempt 2"):
+        clients.with_retries(method)
+    assert method.calls == 3
+
+
+@pytest.mark.parametrize("error", [ValueError("bad request"), unexpected_response(404), unexpected_response(400)])
+def test_with_retries_does_not_retry_other_errors(error):
+    method = Flaky(error)
+    with pytest.raises(type(error)):
+        clients.with_retries(method)
+    assert method.calls == 1
@@ -0,0 +1,60 @@
+"""CSV and Parquet output of combination_writer.py (CSVs must match the DataFrame.to_csv output they replaced)."""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from combination_writer import COMBINATION_COLUMNS, CombinationWriter, RowWriter
+
+ROWS = [
+    {'track_path': 's3://bucket/f1/t1.wav', 'replaced_stem_type': 'kick', 'replacing_stem_type': 'kick',
+     'replacing_stem_path': 's3://bucket/f2/s1.wav', 'similarity_score': 0.9556956195407991},
+    {'track_path': 's3://bucket/f1/t1.wav', 'replaced_stem_type': 'pad, warm', 'replacing_stem_type': 'say "hi"',
+     'replacing_stem_path': 's3://bucket/f2/s2.wav', 'similarity_score': 0.7},
+]
+
+
+def test_csv_matches_to_csv(tmp_path):
+    path = tmp_path / "combinations.csv"
+    with CombinationWriter(str(path), chunk_size=1) as writer:
+        writer.write(ROWS)
+    expected = tmp_path / "expected.csv"
+    pd.DataFrame(ROWS, columns=COMBINATION_COLUMNS).to_csv(expected, index=False)
+    assert path.read_bytes() == expected.read_bytes()
+    assert b"\r" not in path.read_bytes()
+
+
+def test_resume_truncates_to_checkpoint(tmp_path):
+    path = tmp_path / "combinations.csv"
+    writer = CombinationWriter(str(path))
+    writer.write(ROWS[:1])
+    writer.flush()
+    size = writer.tell()
+    writer.write(ROWS[1:])
+    writer.close(complete=False)
+
+    writer = CombinationWriter(str(path), resume_size=size)
+    writer.write(ROWS[1:])
+    writer.close()
+    expected = tmp_path / "expected.csv"
+    pd.DataFrame(ROWS, columns=COMBINATION_COLUMNS).to_csv(expected, index=False)
+    assert path.read_bytes() == expected.read_bytes()
+
+
+def test_metadata_tempo_is_numeric_in_csv_and_parquet(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    from extract_metadata import METADATA_COLUMNS, track_metadata
+
+    tempos = [120, 120.5, "98", "fast", None, True]
+    rows = [track_metadata({'folder': 'f', 'audio_filename': f't{i}.wav', 'tempo': tempo})
+            for i, tempo in enumerate(tempos)]
+    path, parquet_path = tmp_path / "track_metadata.csv", tmp_path / "track_metadata.parquet"
+    with RowWriter(str(path), METADATA_COLUMNS, parquet_path=str(parquet_path),
+                   parquet_types={'tempo': 'float64'}) as writer:
+        writer.write(rows)
+    assert pq.read_table(parquet_path).column('tempo').to_pylist() == [120.0, 120.5, 98.0, None, None, None]
+    assert pd.read_csv(path)['tempo'].tolist() == pytest.approx([120.0, 120.5, 98.0] + [float('nan')] * 3,
+                                                                 nan_ok=True)
@@ -0,0 +1,80 @@
+"""Loading extract_metadata.py output with load_to_postgres.py (needs the POSTGRES_* database, skipped otherwise)."""
+
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import load_to_postgres as ltp
+from combination_writer import COMBINATION_COLUMNS, RowWriter
+from extract_metadata import METADATA_COLUMNS, track_metadata
+from path_dictionary import CombinationEncoder
+
+PAYLOADS = [
+    {'folder': 'f', 'audio_filename': 'a.wav', 'key': 'C', 'tempo': 120.5},
+    {'folder': 'f', 'audio_filename': 'b.wav', 'key': 'C', 'tempo': "98"},
+    {'folder': 'f', 'audio_filename': 'c.wav', 'key': 'D', 'tempo': 140},
+    {'folder': 'f', 'audio_filename': 'd.wav', 'key': 'D', 'tempo': "fast"},
+]
+
+
+@pytest.fixture
+def conn():
+    psycopg2 = pytest.importorskip("psycopg2")
+    try:
+        conn = ltp.connect()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Postgres is not reachable: {e}")
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def schema(conn):
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    yield name
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute(f'drop schema if exists "{name}" cascade')
+    conn.commit()
+
+
+def write_metadata(path):
+    with RowWriter(str(path), METADATA_COLUMNS) as writer:
+        writer.write(track_metadata(payload) for payload in PAYLOADS)
+
+
+def test_fractional_tempo_loads(conn, schema, tmp_path):
+    path = tmp_path / "track_metadata.csv"
+    write_metadata(path)
+    assert ltp.copy_csv(conn, "track_metadata", str(path), schema=schema) == (4, None)
+    with conn.cursor() as cursor:
+        cursor.execute(f'select tempo::float8 from "{schema}".track_metadata order by audio_filename')
+        assert [row[0] for row in cursor.fetchall()] == [120.5, 98.0, 140.0, None]
+
+
+def test_fractional_tempo_partitions_combinations(conn, schema, tmp_path):
+    metadata_path, combinations_path = tmp_path / "track_metadata.csv", tmp_path / "combinations.csv"
+    write_metadata(metadata_path)
+    ltp.copy_csv(conn, "track_metadata", str(metadata_path), schema=schema)
+    with RowWriter(str(combinations_path), COMBINATION_COLUMNS) as writer:
+        writer.write({'track_path': f"s3://rtsy-gramosynth/f/{payload['audio_filename']}",
+                      'replaced_stem_type': 'kick', 'replacing_stem_type': 'kick',
+                      'replacing_stem_path': 's3://rtsy-gramosynth/g/kick.wav', 'similarity_score': 0.9}
+                     for payload in PAYLOADS)
+    encoder = CombinationEncoder.open(str(tmp_path / "track_paths.csv"), str(tmp_path / "stem_paths.csv"))
+
+    rows, _ = ltp.copy_csv(conn, "stem_combinations", str(combinations_path), schema=schema, partitioned=True,
+                           encoder=encoder)
+    assert rows == 4
+    with conn.cursor() as cursor:
+        cursor.execute(f'select tableoid::regclass::text, tempo::float8 from "{schema}".stem_combinations '
+                       "order by track_id")
+        assert cursor.fetchall() == [
+            (f"{schema}.stem_combinations_c_t2", 120.5),
+            (f"{schema}.stem_combinations_c_t1", 98.0),
+            (f"{schema}.stem_combinations_d_t3", 140.0),
+            (f"{schema}.stem_combinations_d_tdefault", None),
+        ]
@@ -0,0 +1,107 @@
+"""match_stems_vectorized must return exactly what match_stems returns, order included."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import get_combinations as gc
+from stem_classifier import CompatibilityContext, StemClassifier
+from track_records import MatchedStem
+
+# Family x family compatibility in the sheets/matrix.csv format read by CompatibilityContext.load
+MATRIX = """,Keys,Chords,Pad,Lead,Guitar,Bass,Drums
+Keys,YES,YES,NO,NO,YES,NO,NO
+Chords,YES,YES,YES,NO,NO,NO,NO
+Pad,NO,YES,YES,YES,NO,NO,NO
+Lead,NO,NO,YES,YES,YES,NO,NO
+Guitar,YES,NO,NO,YES,YES,NO,NO
+Bass,NO,NO,NO,NO,NO,YES,NO
+Drums,NO,NO,NO,NO,NO,NO,YES
+"""
+
+
+@pytest.fixture(scope="module")
+def classifier(tmp_path_factory):
+    matrix_path = tmp_path_factory.mktemp("sheets") / "matrix.csv"
+    matrix_path.write_text(MATRIX)
+    return StemClassifier(CompatibilityContext.load(gc.get_stem_family_mapping(), str(matrix_path)))
+
+
+def track(description, score, *stems, **payload):
+    """Similar track record with stems given as (type, filename) per slot, starting at slot 1"""
+    payload = {"folder": f"folder_{description}", "source": "gramosynth", **payload}
+    for i, (stem_type, stem_filename) in enumerate(stems, start=1):
+        if stem_type is not ...:
+            payload[f"stem_{i}_type"] = stem_type
+        if stem_filename is not ...:
+            payload[f"stem_{i}_filename"] = stem_filename
+    return {"description": description, "score": score, "payload": payload}
+
+
+def as_tuples(stem_pairs):
+    return [
+        (pair["original_stem"], [tuple(getattr(stem, name) for name in MatchedStem.__slots__)
+                                 for stem in pair["matched_stems"]])
+        for pair in stem_pairs
+    ]
+
+
+ORIGINALS = ["kick (kick.wav)", "bass", "808 bass (sub.wav)", "piano", "pad", "unknown thing (x.wav)"]
+
+HITS = {
+    "ties": [
+        track("a", 0.9, ("kick", "a_kick.wav"), ("bass", "a_bass.wav")),
+        track("b", 0.9, ("kick", "b_kick.wav"), ("bass guitar", "b_bass.wav")),
+        track("c", 0.9, ("snare", "c_snare.wav"), ("808", "c_808.wav")),
+    ],
+    "duplicate_stem_types": [
+        track("a", 0.95, ("kick", "a1.wav"), ("kick", "a2.wav"), ("kick", "a3.wav"), ("piano", "a4.wav")),
+        track("b", 0.8, ("kick", "b1.wav"), ("acoustic piano", "b2.wav"), ("piano", "b3.wav")),
+    ],
+    "missing_and_none_slots": [
+        track("a", 0.93, ("kick", None), (None, "a2.wav"), ("", "a3.wav"), ("bass", ...), (..., "a5.wav"),
+              ("pad", "a6.wav"), ("ambient", "a7.wav")),
+        track("b", 0.71, (..., ...), ("piano", "b2.wav"), (..., ...), (..., ...), (..., ...), (..., ...),
+              ("kick", "b7.wav")),
+        track("c", 0.5),
+    ],
+    "unknown_types": [
+        track("a", 0.99, ("totally unknown", "a1.wav"), ("kick", "a2.wav")),
+        track("b", 0.98, ("weird noise", "b1.wav"), ("unknown thing", "b2.wav")),
+    ],
+    "mixed_scores": [
+        track(str(i), round(1 - i * 0.013, 3), ("kick", f"{i}_k.wav"), ("808", f"{i}_808.wav"),
+              ("chords", f"{i}_c.wav"), ("pad", f"{i}_p.wav"), ("piano", f"{i}_pi.wav"),
+              ("acoustic drums", f"{i}_d.wav"), ("bass", f"{i}_b.wav"))
+        for i in range(12)
+    ],
+    "empty": [],
+    "no_stems": [track("a", 0.9), track("b", 0.8)],
+}
+
+
+@pytest.mark.parametrize("top_k", [None, 1, 2, 5])
+@pytest.mark.parametrize("hits", sorted(HITS))
+def test_vectorized_matches_loop(classifier, hits, top_k):
+    expected = gc.match_stems(ORIGINALS, HITS[hits], classifier=classifier, top_k=top_k)
+    result = gc.match_stems_vectorized(ORIGINALS, HITS[hits], classifier=classifier, top_k=top_k)
+    assert as_tuples(result) == as_tuples(expected)
+
+
+def test_empty_hits_return_no_pairs(classifier):
+    assert (gc.match_stems_vectorized(ORIGINALS, [], classifier=classifier)
+            == gc.match_stems(ORIGINALS, [], classifier=classifier) == [])
+
+
+def test_no_original_stems(classifier):
+    hits = HITS["ties"]
+    assert (gc.match_stems_vectorized([], hits, classifier=classifier)
+            == gc.match_stems([], hits, classifier=classifier) == [])
+
+
+def test_top_k_truncates_each_original(classifier):
+    result = gc.match_stems_vectorized(ORIGINALS, HITS["mixed_scores"], classifier=classifier, top_k=2)
+    assert result
+    assert all(len(pair["matched_stems"]) <= 2 for pair in result)
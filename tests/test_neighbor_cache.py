@@ -0,0 +1,90 @@
+"""Partition validation of neighbor_cache.NeighborCache."""
+
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from neighbor_cache import CachedHit, NeighborCache
+
+VECTOR = [0.1, 0.2, 0.3]
+HITS = [CachedHit(2, 0.9, {"stem_1_type": "kick"}, None)]
+
+
+class Counter:
+    """count_partition returning a settable count and recording whether the cache lock was held"""
+
+    def __init__(self, count):
+        self.count = count
+        self.calls = 0
+        self.cache = None
+        self.locked = []
+
+    def __call__(self, key, tempo):
+        self.calls += 1
+        self.locked.append(self.cache._lock.locked())
+        return self.count
+
+
+def open_cache(tmp_path, counter):
+    cache = NeighborCache(str(tmp_path / "neighbors.sqlite"), "collection", counter)
+    counter.cache = cache
+    return cache
+
+
+def test_count_runs_outside_the_lock(tmp_path):
+    counter = Counter(5)
+    cache = open_cache(tmp_path, counter)
+    assert cache.get(1, VECTOR, "C", 120, 0.7) is None
+    cache.put(1, VECTOR, "C", 120, 0.7, HITS)
+    assert cache.get(1, VECTOR, "C", 120, 0.7) == HITS
+    # Counted once per partition, never while holding the lock
+    assert counter.calls == 1
+    assert counter.locked == [False]
+    cache.close()
+
+
+def test_changed_candidate_count_drops_results(tmp_path):
+    counter = Counter(5)
+    cache = open_cache(tmp_path, counter)
+    cache.put(1, VECTOR, "C", 120, 0.7, HITS)
+    cache.close()
+
+    cache = open_cache(tmp_path, counter)
+    assert cache.get(1, VECTOR, "C", 120, 0.7) == HITS
+    cache.close()
+
+    counter.count = 6
+    cache = open_cache(tmp_path, counter)
+    assert cache.get(1, VECTOR, "C", 120, 0.7) is None
+    cache.close()
+
+
+def test_slow_count_does_not_block_other_partitions(tmp_path):
+    counter = Counter(5)
+    cache = open_cache(tmp_path, counter)
+    cache.put(1, VECTOR, "D", 90, 0.7, HITS)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_count(key, tempo):
+        if key == "C":
+            started.set()
+            release.wait(5)
+        return counter(key, tempo)
+
+    cache.count_partition = slow_count
+    thread = threading.Thread(target=cache.get, args=(1, VECTOR, "C", 120, 0.7))
+    thread.start()
+    assert started.wait(5)
+    # The lookup of a validated partition goes through while C is being counted
+    results = []
+    lookup = threading.Thread(target=lambda: results.append(cache.get(1, VECTOR, "D", 90, 0.7)))
+    lookup.start()
+    lookup.join(1)
+    finished = not lookup.is_alive()
+    release.set()
+    lookup.join()
+    assert finished
+    assert results == [HITS]
+    thread.join()
+    cache.close()
@@ -0,0 +1,97 @@
+"""
+Compact records for the tracks, search hits and matched stems of get_combinations.py.
+
+The records use __slots__ instead of a per-instance dict and hold vectors as NumPy
+float32 arrays. They support the same item access as the dicts they replace
+(track["payload"], hit["score"], matched_stem["stem_type"], ...), so the matching
+and combination code works on either.
+"""
+
+import numpy as np
+
+# Stem slot numbers of the payloads (stem_<i>_type, stem_<i>_filename)
+STEM_SLOTS = range(1, 8)
+
+# Payload fields read from tracks and search hits in compact mode
+TRACK_PAYLOAD_FIELDS = ["key", "tempo", "folder", "audio_filename", "source"] + [
+    f"stem_{i}_{field}" for i in STEM_SLOTS for field in ("type", "filename")
+]
+
+
+class Record:
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class TrackRecord(Record):
+    """A scrolled track; vector is {"audio": float32 array} like the dict record"""
+
+    __slots__ = ("id", "payload", "audio", "page_offset")
+
+    def __init__(self, id, payload, audio, page_offset):
+        self.id = id
+        self.payload = payload
+        self.audio = audio
+        self.page_offset = page_offset
+
+    @classmethod
+    def from_point(cls, point, page_offset, vector_name="audio"):
+        vector = (point.vector or {}).get(vector_name)
+        audio = None if vector is None else np.asarray(vector, dtype=np.float32)
+        return cls(point.id, point.payload or {}, audio, page_offset)
+
+    @property
+    def vector(self):
+        return {"audio": self.audio}
+
+
+class HitRecord(Record):
+    """A search hit, as returned by get_combinations.process_results"""
+
+    __slots__ = ("index", "id", "score", "payload")
+
+    # Search hits are requested without vectors
+    vector = None
+
+    def __init__(self, index, id, score, payload):
+        self.index = index
+        self.id = id
+        self.score = score
+        self.payload = payload
+
+    @property
+    def description(self):
+        payload = self.payload
+        return (f"{self.index} - {payload.get('genre', 'Unknown')} - {payload.get('mood', 'Unknown')}"
+                f" - {payload.get('energy', 'Unknown')}")
+
+
+class MatchedStem(Record):
+    """A stem of a similar track compatible with an original stem, see match_stems"""
+
+    __slots__ = ("track_description", "stem_type", "stem_filename", "folder", "source", "similarity_score",
+                 "match_type", "original_normalized", "matched_normalized")
+
+    def __init__(self, track_description, stem_type, stem_filename, folder, source, similarity_score, match_type,
+                 original_normalized, matched_normalized):
+        self.track_description = track_description
+        self.stem_type = stem_type
+        self.stem_filename = stem_filename
+        self.folder = folder
+        self.source = source
+        self.similarity_score = similarity_score
+        self.match_type = match_type
+        self.original_normalized = original_normalized
+        self.matched_normalized = matched_normalized